@@ -1,8 +1,9 @@
 from pathlib import Path
-from typing import Final, TYPE_CHECKING
-from xml.etree.ElementTree import fromstring, Element
+from typing import Final, TYPE_CHECKING, Iterator
+from xml.etree.ElementTree import fromstring, Element, XMLPullParser
 
-from PySide6.QtGui import QPixmap, QPainter, Qt
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QPixmap, QPainter, Qt, QImageReader, QImage
 
 from bass import Music, SoundEffect
 
@@ -13,18 +14,23 @@ __all__ = (
     'Resources',
     'parse_xml',
     'parse_xml_string',
+    'iterparse_xml',
 )
 
 _resources: 'Resources | None' = None
 XML_HEADER: Final = '<?xml version="1.0" encoding="UTF-8"?>'
 REANIM_NAME_HEADER: Final = 'IMAGE_REANIM_'
 resources_root = Path()  # 填入 PvZ 程序所在文件夹路径
+REANIM_CACHE_DIR: Final = Path.home() / '.cache' / 'PythonPVZ' / 'reanim'
 
 
 class Resources:
     prop_all: dict[str, dict[str, Path]]
     img_cache: dict[str, QPixmap]
+    qimage_cache: dict[str, QImage]  # 由 img_cache 转换，可以在非 GUI 线程中绘制
+    img_size_cache: dict[str, QSize]
     anim_cache: dict[str, 'Animation']
+    reanim_cache_dir: Path | None  # .reanimc 缓存所在文件夹，为 None 时总是解析 XML
     main_music: 'Music | None'
     sound_effects: dict[str, SoundEffect]
 
@@ -50,13 +56,8 @@ class Resources:
     def load_pixmap(self, name: str) -> QPixmap:
         if name in self.img_cache:
             return self.img_cache[name]
-        path = self.find(name)
-        if path:
-            img = self._pixmap_with_mask(path)
-        elif name.startswith(REANIM_NAME_HEADER):
-            img = self._pixmap_with_mask(resources_root / 'reanim' / f'{name[len(REANIM_NAME_HEADER):]}')
-        else:
-            img = None
+        path = self._image_path(name)
+        img = None if path is None else self._pixmap_with_mask(path)
         if img is None or img.isNull():
             img = QPixmap(100, 100)
             painter = QPainter(img)
@@ -65,8 +66,51 @@ class Resources:
         self.img_cache[name] = img
         return img
 
+    def load_qimage(self, name: str) -> QImage:
+        """load_pixmap(name) 转换成的 QImage，只能在 GUI 线程中调用"""
+        if name in self.qimage_cache:
+            return self.qimage_cache[name]
+        img = self.load_pixmap(name).toImage()
+        self.qimage_cache[name] = img
+        return img
+
+    def image_size(self, name: str) -> QSize:
+        """load_pixmap(name) 的大小，图片尚未加载时只读取文件头，不解码像素"""
+        if name in self.img_cache:
+            return self.img_cache[name].size()
+        if name in self.img_size_cache:
+            return self.img_size_cache[name]
+        path = self._image_path(name)
+        img_path = None if path is None else self._image_files(path)[0]
+        size = QSize() if img_path is None else QImageReader(str(img_path)).size()
+        if size.isEmpty():  # 文件不存在或无法只读文件头，与 load_pixmap 的结果（可能是占位图）一致
+            size = self.load_pixmap(name).size()
+        self.img_size_cache[name] = size
+        return size
+
+    def _image_path(self, name: str) -> Path | None:
+        path = self.find(name)
+        if path:
+            return path
+        if name.startswith(REANIM_NAME_HEADER):
+            return resources_root / 'reanim' / f'{name[len(REANIM_NAME_HEADER):]}'
+        return None
+
     @staticmethod
     def _pixmap_with_mask(path: Path) -> QPixmap:
+        img_path, mask_path = Resources._image_files(path)
+        if img_path is None:
+            return QPixmap()
+        res = QPixmap(img_path)
+        if mask_path is not None:
+            mask = QPixmap(str(mask_path))
+            res.setMask(mask.createMaskFromColor(Qt.black))
+            print(mask_path)
+        return res
+
+    @staticmethod
+    def _image_files(path: Path) -> tuple[Path | None, Path | None]:
+        """path 对应的图片文件与遮罩文件（文件名后加 _），大小写不敏感"""
         suffixes = _PropertyCalculator.SUFFIXES_FOR['Image']
         need = path.stem.upper()
         mask_need = need + '_'
@@ -83,26 +127,34 @@ class Resources:
                     mask_path = file
                     if img_path is not None:
                         break
-        if img_path is None:
-            return QPixmap()
-        res = QPixmap(img_path)
-        if mask_path is not None:
-            mask = QPixmap(str(mask_path))
-            res.setMask(mask.createMaskFromColor(Qt.black))
-            print(mask_path)
-        return res
+        return img_path, mask_path
 
     def load_reanim(self, name_or_path: str | Path) -> 'Animation':
-        from anp import Reanim
         if isinstance(name_or_path, Path):
-            return Reanim.load(name_or_path)  # 通过路径访问不缓存
+            return self._load_reanim_file(name_or_path)  # 通过路径访问不缓存
         name = name_or_path
         if name in self.anim_cache:
             return self.anim_cache[name]
-        anim = Reanim.load(resources_root / 'reanim' / f'{name}.reanim')
+        anim = self._load_reanim_file(resources_root / 'reanim' / f'{name}.reanim')
         self.anim_cache[name] = anim
         return anim
 
+    def load_reanim_private(self, path: Path) -> 'Animation':
+        """重新加载 path 及其所有附件动画，不读写 anim_cache，结果不与其他动画共享任何对象"""
+        anim_cache = self.anim_cache
+        self.anim_cache = {}
+        try:
+            return self._load_reanim_file(path)
+        finally:
+            self.anim_cache = anim_cache
+
+    def _load_reanim_file(self, path: Path) -> 'Animation':
+        if self.reanim_cache_dir is None:
+            from anp import Reanim
+            return Reanim.load(path)
+        from anp.reanimc import load_reanim
+        return load_reanim(path, self.reanim_cache_dir)
+
     def load_anim_by_name(self, name: str) -> 'Animation':
         return self.load_reanim(name)
 
@@ -128,7 +180,10 @@ class Resources:
         _resources = Resources()
         _resources.prop_all = {}
         _resources.img_cache = {}
+        _resources.qimage_cache = {}
+        _resources.img_size_cache = {}
         _resources.anim_cache = {}
+        _resources.reanim_cache_dir = REANIM_CACHE_DIR
         _resources.sound_effects = {}
         _resources.main_music = None
         return _resources
@@ -218,3 +273,21 @@ def parse_xml_string(s: str) -> Element:
 def parse_xml(path: Path) -> Element:
     s = path.read_text('utf-8')
     return parse_xml_string(s)
+
+
+def iterparse_xml(path: Path, chunk_size: int = 1 << 16) -> Iterator[tuple[str, Element]]:
+    """逐块读取文件并产生 ('start' | 'end', 元素) 事件，与 parse_xml 一样为无根节点的文件补上 dummy-top"""
+    parser = XMLPullParser(('start', 'end'))
+    with path.open(encoding='utf-8') as f:
+        chunk = f.read(chunk_size)
+        wrapped = not chunk.startswith('<?')
+        if wrapped:
+            parser.feed(f'{XML_HEADER}<dummy-top>')
+        while chunk:
+            parser.feed(chunk)
+            yield from parser.read_events()
+            chunk = f.read(chunk_size)
+    if wrapped:
+        parser.feed('</dummy-top>')
+    parser.close()
+    yield from parser.read_events()
@@ -1,17 +1,23 @@
-from time import time
-
 from PySide6.QtCore import QRectF, QPointF
 from PySide6.QtGui import QPainter
 from PySide6.QtWidgets import QGraphicsItem
 
+from .batch import PlayerBatch
+from .clock import SceneClock, scene_clock
+from .crowd import CrowdItem, CrowdInstance
 from .player import AnimationPlayer, Animation, Item, Reanim
 
 __all__ = (
     'AnimationPlayer',
+    'PlayerBatch',
     'Animation',
     'Item',
     'Reanim',
     'AnimatedItem',
+    'CrowdItem',
+    'CrowdInstance',
+    'SceneClock',
+    'scene_clock',
 )
 
 
@@ -24,31 +30,55 @@ class AnimatedItem(QGraphicsItem):
         self.anim = anim
         self._player = AnimationPlayer(self.anim)
         self._player.ground_moved = self.__move
-        self.prepareGeometryChange()
         self.movable = True
-        self.time = time()
+        self._bounds = QRectF()
+        self._visible_state: tuple | None = None
+        self._refresh()
+
+    @property
+    def player(self) -> AnimationPlayer:
+        """可以加入 PlayerBatch，之后由 PlayerBatch.step 推进，advance 只刷新显示"""
+        return self._player
 
     def set_anim(self, name: str):
         self._player.set_anim(name)
+        self._refresh()
 
     def paint(self, painter: QPainter, _1, _2=None) -> None:
         self._player.paint(painter)
 
     def advance(self, phase: int) -> None:
-        if not phase:
-            return
-        new_time = time()
-        self._player.update(new_time - self.time)
-        self.time = new_time
+        clock = scene_clock(self.scene())
+        elapsed = clock.advance(phase)
+        if phase:
+            if clock.frame_step is not None:
+                self._player.frame_step = clock.frame_step
+            if self._player.batch is None:
+                # 加入 PlayerBatch 的播放器由 PlayerBatch.step 推进，这里只刷新
+                self._player.update(elapsed)
+            self._refresh()
 
     def boundingRect(self) -> QRectF:
-        return self._player.bounding_rect()
+        return self._bounds
+
+    def _refresh(self) -> None:
+        """只在包围盒或绘制内容改变时通知场景"""
+        bounds = self._player.clip_bounding_rect()
+        if bounds != self._bounds:
+            self.prepareGeometryChange()
+            self._bounds = bounds
+        state = self._player.visible_state()
+        if state != self._visible_state:
+            self._visible_state = state
+            self.update()
 
     def hide_item(self, name: str):
         self._player.hide_item(name)
+        self._refresh()
 
     def show_item(self, name: str):
         self._player.show_item(name)
+        self._refresh()
 
     def __move(self, ground_translate: QPointF):
         if self.movable:
@@ -56,11 +86,19 @@ class AnimatedItem(QGraphicsItem):
             self.setPos(self.pos() - ground_translate)
 
     def set_items_hidden(self, hidden: bool, *items: str):
-        for item in items:
-            if hidden:
-                self.hide_item(item)
-            else:
-                self.show_item(item)
+        self._player.set_items_hidden(hidden, *items)
+        self._refresh()
 
     def set_speed(self, speed: float):
         self._player.speed = speed
+
+    def set_baked(self, quantization: int):
+        """quantization 大于 0 时把当前子动画的每帧（每帧细分为 quantization 份）预先绘制成位图，
+        相同动画的物体共享这些位图；为 0 时每次重新合成所有轨道"""
+        self._player.bake_quantization = quantization
+        self._refresh()
+
+    def set_frame_step(self, step: int):
+        """step 大于 0 时只显示每帧的 step 个细分点（1 即逐帧播放），显示的帧不变时不重绘；为 0 时连续插值"""
+        self._player.frame_step = step
+        self._refresh()
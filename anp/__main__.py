@@ -1,27 +1,18 @@
+import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Final
+from typing import TYPE_CHECKING
 
-from PySide6.QtCore import QTimer, QRectF, QPointF
-from PySide6.QtGui import QAction, QImage, QPainter, Qt
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QAction
 from PySide6.QtWidgets import QMainWindow, QApplication, QFileDialog, QGraphicsScene, QGraphicsView, QVBoxLayout, \
-    QDialog, QLabel, QSpinBox, QHBoxLayout, QCheckBox
+    QDialog, QLabel, QSpinBox, QHBoxLayout, QCheckBox, QProgressDialog, QMessageBox
 
-app = QApplication()
-
-from anp import AnimatedItem, Animation
+from anp import AnimatedItem, Animation, scene_clock
 from Resources import Resources
 
-
-class SameIntervalAnimItem(AnimatedItem):
-    def __init__(self, anim: Animation, interval: float):
-        super().__init__(anim)
-        self.interval = interval
-
-    def advance(self, phase: int) -> None:
-        if not phase:
-            return
-        self._player.update(self.interval)
+if TYPE_CHECKING:
+    from anp.export import VideoExport
 
 
 class MainWindow(QMainWindow):
@@ -38,9 +29,10 @@ class MainWindow(QMainWindow):
 
         self.timer = QTimer(self)
         self.timer.setInterval(1000 // self.settings.render_fps)
-        self.timer.timeout.connect(lambda: (self.scene.advance(), self.scene.update()))
+        self.timer.timeout.connect(lambda: self.scene.advance())
 
         self.scene = QGraphicsScene()
+        self.clock = scene_clock(self.scene)
         self.view = QGraphicsView(self.scene)
         self.view.setParent(self)
         self.view.setGeometry(self.geometry())
@@ -51,7 +43,10 @@ class MainWindow(QMainWindow):
         self.menuBar().raise_()
 
         self.anim: Animation | None = None
-        self.item: SameIntervalAnimItem | None = None
+        self.anim_path: Path | None = None
+        self.export: 'VideoExport | None' = None
+        self.progress_dialog: QProgressDialog | None = None
+        self.item: AnimatedItem | None = None
         self.resources_root: Path | None = None  # 通过 load_resource 加载的资源根路径
 
     def open(self):
@@ -65,52 +60,52 @@ class MainWindow(QMainWindow):
         if self.resources_root is None:
             set_resources_root(path.parent.parent)  # 便于不加载 resources.xml 直接查看文件
         self.anim = Resources.instance().load_reanim(path)
+        self.anim_path = path
         self.item = self.make_item()
         self.scene.addItem(self.item)
-        self.timer.start()
+        self.start_playing()
 
     def save(self):
-        suffix2coding = {
-            'mp4': 'mp4v',
-            'avi': 'XVID',
-            'reanim': '',
-        }
+        from anp.export import VIDEO_CODECS, VideoExport
+        if self.export is not None:
+            return
+        suffixes = [*VIDEO_CODECS, 'reanim']
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "导出", filter=', '.join(f'*.{name}' for name in suffix2coding.keys()))
+            self, "导出", filter=', '.join(f'*.{name}' for name in suffixes))
         anim = self.anim
         if not file_path:
             return
         if file_path.endswith('.reanim'):
             anim.save(file_path)
             return
-        bounding = anim.bounding_rect_at(0, [])
-        for i in range(1, anim.max_frame() + 1):
-            bounding = bounding_rect(bounding, anim.bounding_rect_at(i, []))
-        size = bounding.size()
-        import cv2
-        fps: Final = 60.0
-        img = QImage(size.toSize(), QImage.Format_ARGB32_Premultiplied)
-
-        coding = suffix2coding[file_path.split('.')[-1]]
-        if isinstance(coding, str):
-            fourcc = cv2.VideoWriter_fourcc(*(list(coding) + [''] * (4 - len(coding))))
-        else:
-            fourcc = coding
-        writer = cv2.VideoWriter(file_path, fourcc, fps, size.toSize().toTuple())
-        sec = 0
-        painter = QPainter(img)
-        painter.translate(-bounding.topLeft())
-        while sec < anim.max_frame() / anim.fps:
-            anim_frame = sec * anim.fps
-            img.fill(Qt.transparent)
-            anim.paint(anim_frame, painter, [])
-            img.save('./temp.bmp')
-            cv_img = cv2.imread('./temp.bmp')
-            writer.write(cv_img)
-            sec += 1 / fps
-        del painter
-        writer.release()
-        Path('./temp.bmp').unlink()
+        self.export = VideoExport(anim, file_path, 60., source=self.anim_path, parent=self)
+        self.export.progress.connect(self.export_progress)
+        self.export.finished.connect(self.export_ended)
+        self.export.canceled.connect(self.export_ended)
+        self.export.failed.connect(self.export_failed)
+        self.progress_dialog = QProgressDialog("正在导出……", "取消", 0, 0, self)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self.export.cancel)
+        self.export.start()
+
+    def export_progress(self, done: int, total: int):
+        if self.progress_dialog is not None:
+            self.progress_dialog.setMaximum(total)
+            self.progress_dialog.setValue(done)
+
+    def export_failed(self, message: str):
+        self.export_ended()
+        QMessageBox.warning(self, "导出失败", message)
+
+    def export_ended(self):
+        if self.progress_dialog is not None:
+            self.progress_dialog.close()
+            self.progress_dialog = None
+        self.export = None
+
+    def start_playing(self):
+        self.clock.reset()  # 不把打开文件前经过的时间算入第一帧
+        self.timer.start()
 
     def load_resource(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "加载资源文件", filter='resources.xml')
@@ -128,14 +123,10 @@ class MainWindow(QMainWindow):
 
     def settings_updated(self):
         self.timer.setInterval(1000 // self.settings.render_fps)
-        if self.item is not None:
-            self.scene.removeItem(self.item)
-            self.item = self.make_item()
-            self.scene.addItem(self.item)
+        self.clock.interval = 1 / self.settings.render_fps if self.settings.use_same_interval else None
+        self.clock.frame_step = self.settings.frame_step
 
     def make_item(self) -> AnimatedItem:
-        if self.settings.use_same_interval:
-            return SameIntervalAnimItem(self.anim, 1 / self.settings.render_fps)
         return AnimatedItem(self.anim)
 
 
@@ -143,6 +134,7 @@ class MainWindow(QMainWindow):
 class Settings:
     render_fps: int = 60
     use_same_interval: bool = False
+    frame_step: int = 0
 
 
 class SettingsWindow(QDialog):
@@ -159,37 +151,36 @@ class SettingsWindow(QDialog):
         self.use_same_interval = QCheckBox(self)
         self.use_same_interval.setChecked(self.settings.use_same_interval)
 
+        self.label3 = QLabel("每帧显示的细分数（0 为连续插值，数值越小越省 CPU）：", self)
+        self.frame_step = QSpinBox(self)
+        self.frame_step.setRange(0, 60)
+        self.frame_step.setValue(self.settings.frame_step)
+
         self.h_layout1 = QHBoxLayout()
         self.h_layout1.addWidget(self.label1)
         self.h_layout1.addWidget(self.render_fps)
         self.h_layout2 = QHBoxLayout()
         self.h_layout2.addWidget(self.label2)
         self.h_layout2.addWidget(self.use_same_interval)
+        self.h_layout3 = QHBoxLayout()
+        self.h_layout3.addWidget(self.label3)
+        self.h_layout3.addWidget(self.frame_step)
 
         self.main_layout = QVBoxLayout(self)
         self.main_layout.addLayout(self.h_layout1)
         self.main_layout.addLayout(self.h_layout2)
+        self.main_layout.addLayout(self.h_layout3)
 
     def get_settings(self) -> Settings:
         self.exec()
         self.settings.render_fps = self.render_fps.value()
         self.settings.use_same_interval = self.use_same_interval.isChecked()
+        self.settings.frame_step = self.frame_step.value()
         return self.settings
 
 
-def bounding_rect(a: QRectF, b: QRectF) -> QRectF:
-    points = []
-    for rect in (a, b):
-        points.extend([rect.topLeft(), rect.topRight(), rect.bottomLeft(), rect.bottomRight()])
-    min_x = min(point.x() for point in points)
-    min_y = min(point.y() for point in points)
-    max_x = max(point.x() for point in points)
-    max_y = max(point.y() for point in points)
-    return QRectF(QPointF(min_x, min_y), QPointF(max_x, max_y))
-
-
 def main():
-    # app = QApplication()
+    app = QApplication()
     main_win = MainWindow()
     main_win.show()
     exit(app.exec())
@@ -203,4 +194,7 @@ def set_resources_root(root: str | Path):
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['render']:
+        from anp.render import main as render_main
+        exit(render_main(sys.argv[2:]))
     main()
@@ -0,0 +1,153 @@
+from typing import Iterable, NamedTuple
+
+import numpy as np
+from PySide6.QtCore import QPointF, QRect, QRectF
+from PySide6.QtGui import QPainter, QPixmap, Qt
+
+from Resources import Resources
+from .player import Animation, NormalItem, AttacherItem, SingleAttachItem
+
+__all__ = (
+    'ShelfPacker',
+    'TextureAtlas',
+    'AtlasInstance',
+)
+
+
+class ShelfPacker:
+    """按高度从大到小逐行摆放矩形；page_height 为 None 时只有一页且高度不限"""
+
+    def __init__(self, page_width: int, page_height: int | None = None, padding: int = 1):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.padding = padding
+
+    def pack(self, sizes: list[tuple[int, int]]) -> tuple[list[tuple[int, int, int]], list[tuple[int, int]]]:
+        """返回每个矩形的 (页, x, y) 与每页实际使用的 (宽, 高)"""
+        padding = self.padding
+        placements: list[tuple[int, int, int]] = [(0, 0, 0)] * len(sizes)
+        pages: list[tuple[int, int]] = []
+        page = -1
+        x = y = shelf_height = 0
+        used_width = 0
+        for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+            width, height = sizes[index]
+            if page != -1 and x + width > self.page_width:
+                # 换行
+                y += shelf_height + padding
+                x = shelf_height = 0
+            if page == -1 or (self.page_height is not None and y + height > self.page_height):
+                # 换页
+                if page != -1:
+                    pages[page] = (used_width, y)
+                pages.append((0, 0))
+                page += 1
+                x = y = shelf_height = used_width = 0
+            placements[index] = (page, x, y)
+            x += width + padding
+            shelf_height = max(shelf_height, height)
+            used_width = max(used_width, x - padding)
+        if page != -1:
+            pages[page] = (used_width, y + shelf_height)
+        return placements, pages
+
+
+class AtlasInstance(NamedTuple):
+    frame: float
+    pos: QPointF
+    hide_items: int | Iterable[str]  # 轨道名或 Animation.hide_mask 得到的位掩码
+
+
+class TextureAtlas:
+    """把若干 Animation 用到的图片打包到少数几张大图上，并用 drawPixmapFragments 绘制
+
+    PySide6 的 drawPixmapFragments 每次只接受一个片段，无法一次提交整批，在 raster 引擎下
+    并不比 Animation.paint 快（Test.reanim 上慢约 30%）；从图集中的子矩形采样时边缘像素
+    可能与 Animation.paint 差 1，约五分之一的帧有差异
+    """
+
+    def __init__(self, pages: list[QPixmap], regions: dict[str, tuple[int, QRectF]]):
+        self.pages = pages
+        self.regions = regions  # 图片名: (页, 在页中的位置)
+
+    @staticmethod
+    def build(anims: Iterable[Animation], page_size: int = 2048, padding: int = 1) -> 'TextureAtlas':
+        names: set[str] = set()
+        for anim in anims:
+            _collect_image_names(anim, names, set())
+        resources = Resources.instance()
+        ordered = sorted(names)
+        images = [resources.load_pixmap(name) for name in ordered]
+        sizes = [(img.width(), img.height()) for img in images]
+        placements, page_sizes = ShelfPacker(page_size, page_size, padding).pack(sizes)
+
+        pages = []
+        for width, height in page_sizes:
+            page = QPixmap(max(width, 1), max(height, 1))
+            page.fill(Qt.transparent)
+            pages.append(page)
+        painters = [QPainter(page) for page in pages]
+        regions = {}
+        for name, img, (width, height), (page, x, y) in zip(ordered, images, sizes, placements):
+            painters[page].drawPixmap(x, y, img)
+            regions[name] = (page, QRectF(QRect(x, y, width, height)))
+        for painter in painters:
+            painter.end()
+        return TextureAtlas(pages, regions)
+
+    def paint(self, anim: Animation, frame: float, painter: QPainter, hide_items: int | Iterable[str]) -> None:
+        self.paint_instances(anim, painter, [AtlasInstance(frame, QPointF(), hide_items)])
+
+    def paint_instances(self, anim: Animation, painter: QPainter, instances: Iterable[AtlasInstance]) -> None:
+        """依次绘制同一动画的多个实例，可以表示为片段的部件直接从图集绘制，不再切换变换矩阵"""
+        # PySide6 的 drawPixmapFragments 每次只接受一个片段，只能逐个提交
+        pages = self.pages
+        items = anim._items
+        for frame, pos, hide_items in instances:
+            mask = anim.hide_mask(hide_items)
+            state = anim.evaluate(frame)
+            # 只有 x、y 方向旋转相同（没有斜切）的部件可以表示为片段
+            uniform = (np.abs(state.x_rotate - state.y_rotate) < 1e-3).tolist()
+            matrices = state.matrices.tolist()
+            values = state.values.T.tolist()
+            for index, item in enumerate(items):
+                if mask >> index & 1:
+                    continue
+                if isinstance(item, NormalItem):
+                    if state.hidden[index]:
+                        continue
+                    region = self.regions.get(item.image_name_at(frame))
+                    if region is not None and uniform[index]:
+                        page, source = region
+                        fragment = self._fragment(matrices[index], values[index], source, pos)
+                        painter.drawPixmapFragments(fragment, 1, pages[page])
+                        continue
+                painter.save()
+                painter.translate(pos)
+                item.paint_evaluated(frame, painter, state, index)
+                painter.restore()
+
+    @staticmethod
+    def _fragment(matrix: list[list[float]], values: list[float], source: QRectF, pos: QPointF) \
+            -> QPainter.PixmapFragment:
+        _, _, scale_x, scale_y, x_rotate, _, opacity = values
+        half_width = source.width() / 2
+        half_height = source.height() / 2
+        (a, c, tx), (b, d, ty) = matrix
+        center = QPointF(a * half_width + c * half_height + tx + pos.x(), b * half_width + d * half_height + ty + pos.y())
+        return QPainter.PixmapFragment.create(center, source, scale_x, scale_y, x_rotate, opacity)
+
+
+def _collect_image_names(anim: Animation, names: set[str], visited: set[int]) -> None:
+    if id(anim) in visited:
+        return
+    visited.add(id(anim))
+    for item in anim._items:
+        if isinstance(item, NormalItem):
+            names.update(item.image_names())
+        elif isinstance(item, AttacherItem):
+            for _, attached, _, _ in item.anim:
+                if attached is not None:
+                    _collect_image_names(attached, names, visited)
+        elif isinstance(item, SingleAttachItem):
+            _collect_image_names(item.anim, names, visited)
@@ -0,0 +1,122 @@
+"""
+预先绘制的帧位图缓存。
+
+python -m anp.baked <.reanim 文件>... 逐帧比较烘焙的位图与直接绘制的结果。
+"""
+import argparse
+from math import floor, ceil
+from pathlib import Path
+from typing import Final, NamedTuple, Iterable
+
+from PySide6.QtCore import QPoint, QRect
+from PySide6.QtGui import QPixmap, QPainter, Qt, QImage
+
+from .cache import LRUCache, FRAME_QUANTIZATION
+from .player import Animation
+
+__all__ = (
+    'BakedFrame',
+    'BAKED_FRAME_BUDGET',
+    'baked_frames',
+    'bake_frame',
+    'mismatched_frames',
+)
+
+BAKED_FRAME_BUDGET: Final = 64 << 20  # 字节
+MARGIN: Final = 2  # 像素
+CHECK_MARGIN: Final = 16  # 像素，比较时在位图四周多绘制的范围，用于发现被裁掉的部分
+
+
+class BakedFrame(NamedTuple):
+    pixmap: QPixmap
+    offset: QPoint  # pixmap 左上角在动画坐标系中的位置
+
+
+def _pixmap_bytes(frame: BakedFrame) -> int:
+    return frame.pixmap.width() * frame.pixmap.height() * 4
+
+
+# 所有播放器共享，键为 (动画, 动画的 version, 子动画, 帧细分数, 细分后的帧下标, 隐藏轨道的位掩码)
+baked_frames: LRUCache[tuple[Animation, int, str, int, int, int], BakedFrame] = \
+    LRUCache(BAKED_FRAME_BUDGET, _pixmap_bytes)
+
+
+def bake_frame(anim: Animation, clip: str, index: int, quantization: int, hide_items: int | Iterable[str]) \
+        -> BakedFrame:
+    """子动画 clip 第 index / quantization 帧的位图，首次请求时绘制"""
+    mask = anim.hide_mask(hide_items)
+    key = (anim, anim.version, clip, quantization, index, mask)
+    return baked_frames.get_or_create(key, lambda: _render(anim, clip, index / quantization, mask))
+
+
+def _render(anim: Animation, clip: str, frame: float, mask: int) -> BakedFrame:
+    start, _ = anim.sub_anim_frame(clip) if clip else (0, 0)
+    frame += start
+    bounding = anim.bounding_rect_at(frame, mask)
+    # 对齐到整数像素，使烘焙结果与直接绘制一致；包围盒按 QRect 的右下角计算，可能少一个像素，因此留出边距
+    left = floor(bounding.left()) - MARGIN
+    top = floor(bounding.top()) - MARGIN
+    pixmap = QPixmap(ceil(bounding.right()) + MARGIN - left, ceil(bounding.bottom()) + MARGIN - top)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    painter.translate(-left, -top)
+    anim.paint(frame, painter, mask)
+    painter.end()
+    return BakedFrame(pixmap, QPoint(left, top))
+
+
+def mismatched_frames(anim: Animation, clip: str, quantization: int, hide_items: int | Iterable[str] = 0) \
+        -> list[int]:
+    """子动画 clip 中烘焙结果与直接绘制不一致（例如包围盒过小被裁掉）的细分帧下标"""
+    mask = anim.hide_mask(hide_items)
+    start, end = anim.sub_anim_frame(clip) if clip else (0, anim.max_frame() + 1)
+    res = []
+    for index in range((end - start - 1) * quantization + 1):
+        baked = bake_frame(anim, clip, index, quantization, mask)
+        area = QRect(baked.offset, baked.pixmap.size()).adjusted(
+            -CHECK_MARGIN, -CHECK_MARGIN, CHECK_MARGIN, CHECK_MARGIN)
+        live = _canvas(area, lambda painter: anim.paint(start + index / quantization, painter, mask))
+        cached = _canvas(area, lambda painter: painter.drawPixmap(baked.offset, baked.pixmap))
+        if live != cached:
+            res.append(index)
+    return res
+
+
+def _canvas(area: QRect, paint) -> QImage:
+    img = QImage(area.size(), QImage.Format_ARGB32_Premultiplied)
+    img.fill(Qt.transparent)
+    painter = QPainter(img)
+    painter.translate(-area.topLeft())
+    paint(painter)
+    painter.end()
+    return img
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m anp.baked', description='比较烘焙的位图与直接绘制的结果')
+    parser.add_argument('inputs', nargs='+', type=Path, help='.reanim 文件')
+    parser.add_argument('--root', type=Path, help='PvZ 资源根目录，默认为第一个文件所在文件夹的上一级')
+    parser.add_argument('--quantization', type=int, default=FRAME_QUANTIZATION, help='每帧的细分数')
+    parser.add_argument('--hide', action='append', default=[], help='隐藏的轨道，可以重复指定')
+    args = parser.parse_args(argv)
+    import Resources
+    root = (args.root or args.inputs[0].parent.parent).resolve()
+    Resources.resources_root = root
+    resources = Resources.Resources.instance()
+    from .parallel import init_offscreen
+    init_offscreen(root, resources.prop_all, None)
+    failed = 0
+    for path in args.inputs:
+        anim = resources.load_reanim(path)
+        for clip in anim.clip_names() or ['']:
+            frames = mismatched_frames(anim, clip, args.quantization, args.hide)
+            if frames:
+                failed += 1
+                shown = ', '.join(f'{index / args.quantization:g}' for index in frames[:8])
+                print(f'{path.name} {clip or "(all)"}: {len(frames)} frames differ: {shown}')
+    print('all frames match' if not failed else f'{failed} clips differ')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
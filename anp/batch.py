@@ -0,0 +1,234 @@
+from typing import Final, NamedTuple, cast
+
+import numpy as np
+from PySide6.QtCore import QPointF
+
+from .player import Animation, AnimationPlayer, NormalItem
+
+__all__ = (
+    'PlayerBatch',
+    'BatchStep',
+)
+
+# 每个播放器一行：(列名, 类型)
+COLUMNS: Final = (
+    ('time', np.float64),  # 单位：s
+    ('speed', np.float64),
+    ('loop_count', np.int64),
+    ('fps', np.float64),
+    ('start', np.int64),  # 子动画的起始帧
+    ('max_frame', np.int64),  # 子动画的最后一帧（相对起始帧）
+    ('transition', np.int64),  # 过渡动画的最后一帧，没有过渡动画时为 -1
+    ('anim', np.int64),  # 在 PlayerBatch._anims 中的下标
+    ('ground_valid', np.bool_),  # 上一次的地面位置是否有效
+    ('ground_x', np.float64),
+    ('ground_y', np.float64),
+)
+
+
+class BatchStep(NamedTuple):
+    """PlayerBatch.step 的结果，数组下标与 PlayerBatch.players 对应"""
+    wrapped: np.ndarray  # 本次回到子动画开头
+    finished: np.ndarray  # 本次回到开头后循环次数用完
+    moved: np.ndarray  # 地面轨道移动了
+    ground_dx: np.ndarray
+    ground_dy: np.ndarray
+
+
+class _GroundTrack(NamedTuple):
+    """_ground 轨道按整数帧展开的位置与隐藏标记"""
+    x: np.ndarray
+    y: np.ndarray
+    hidden: np.ndarray
+
+    @staticmethod
+    def of(anim: Animation, ground: NormalItem) -> '_GroundTrack':
+        frames = range(max(anim.max_frame() + 1, 1))
+        positions = [ground.pos_at(frame) for frame in frames]
+        return _GroundTrack(
+            np.array([pos.x() for pos in positions]),
+            np.array([pos.y() for pos in positions]),
+            np.array([ground.hidden_at(frame) for frame in frames], np.bool_),
+        )
+
+    def at(self, frames: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        last = len(self.hidden) - 1
+        frames = np.clip(frames, 0., float(last))
+        f0 = frames.astype(np.int64)
+        f1 = np.minimum(f0 + 1, last)
+        progress = frames - f0
+        x = self.x[f0] + (self.x[f1] - self.x[f0]) * progress
+        y = self.y[f0] + (self.y[f1] - self.y[f0]) * progress
+        return x, y, self.hidden[f0]
+
+
+class PlayerBatch:
+    """把多个 AnimationPlayer 的时钟状态存放在 numpy 数组中，用一次 step 推进所有播放器
+
+    加入后播放器的 time、speed、loop_count 直接读写这里的数组，不能再调用 AnimationPlayer.update
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.players: list[AnimationPlayer] = []
+        self._anims: list[Animation] = []
+        self._anim_ids: dict[Animation, int] = {}
+        self._versions: list[int] = []  # 与 _anims 对应，计算 _grounds 等时动画的 version
+        self._grounds: list[_GroundTrack | None] = []
+        for name, dtype in COLUMNS:
+            setattr(self, f'_{name}', np.zeros(max(capacity, 1), dtype))
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def __contains__(self, player: AnimationPlayer) -> bool:
+        return player._batch is self
+
+    @property
+    def time(self) -> np.ndarray:
+        return self._time[:len(self.players)]
+
+    @property
+    def speed(self) -> np.ndarray:
+        return self._speed[:len(self.players)]
+
+    @property
+    def loop_count(self) -> np.ndarray:
+        return self._loop_count[:len(self.players)]
+
+    def add(self, player: AnimationPlayer) -> None:
+        if player._batch is not None:
+            raise ValueError('player already belongs to a PlayerBatch')
+        slot = len(self.players)
+        if slot == len(self._time):
+            self._grow(slot * 2)
+        self._time[slot] = player.time
+        self._speed[slot] = player.speed
+        self._loop_count[slot] = player.loop_count
+        self._ground_valid[slot] = False
+        self.players.append(player)
+        player._attach(self, slot)
+        self.sync(player)
+
+    def remove(self, player: AnimationPlayer) -> None:
+        if player._batch is not self:
+            raise ValueError('player does not belong to this PlayerBatch')
+        slot = player._slot
+        player._detach()
+        # 用最后一行填补空位
+        last = len(self.players) - 1
+        moved = self.players.pop()
+        for name, _ in COLUMNS:
+            column = getattr(self, f'_{name}')
+            column[slot] = column[last]
+            column[last] = 0
+        if slot != last:
+            self.players[slot] = moved
+            moved._slot = slot
+
+    def sync(self, player: AnimationPlayer) -> None:
+        """播放器的动画、子动画或过渡动画改变后调用，由 AnimationPlayer 自动完成"""
+        slot = player._slot
+        anim = player.anim
+        self._fps[slot] = anim.fps
+        self._start[slot] = player.playing_frames()[0]
+        self._max_frame[slot] = player.max_frame()
+        self._transition[slot] = player.transition_max_frame()
+        self._anim[slot] = self._anim_id(anim, player)
+
+    def _anim_id(self, anim: Animation, player: AnimationPlayer) -> int:
+        res = self._anim_ids.get(anim)
+        if res is None:
+            res = self._anim_ids[anim] = len(self._anims)
+            self._anims.append(anim)
+            self._versions.append(anim.version)
+            ground = player.ground_track()
+            self._grounds.append(None if ground is None else _GroundTrack.of(anim, ground))
+        return res
+
+    def _sync_changed(self) -> None:
+        """动画修改后（version 改变）重新计算地面轨道，并同步播放它的播放器"""
+        n = len(self.players)
+        for anim_id, anim in enumerate(self._anims):
+            if anim.version == self._versions[anim_id]:
+                continue
+            self._versions[anim_id] = anim.version
+            if self._grounds[anim_id] is not None:
+                ground = cast(NormalItem, anim.find_item_by_name('_ground'))
+                self._grounds[anim_id] = _GroundTrack.of(anim, ground)
+            for slot in np.flatnonzero(self._anim[:n] == anim_id).tolist():
+                self.sync(self.players[slot])
+
+    def _grow(self, capacity: int) -> None:
+        for name, dtype in COLUMNS:
+            old = getattr(self, f'_{name}')
+            new = np.zeros(capacity, dtype)
+            new[:len(old)] = old
+            setattr(self, f'_{name}', new)
+
+    def step(self, elapsed_time: float) -> BatchStep:
+        """所有播放器前进 elapsed_time 秒，与逐个调用 AnimationPlayer.update 的结果相同"""
+        self._sync_changed()
+        n = len(self.players)
+        time = self._time[:n]
+        loop_count = self._loop_count[:n]
+        fps = self._fps[:n]
+        max_frame = self._max_frame[:n]
+        transition = self._transition[:n]
+        ground_valid = self._ground_valid[:n]
+
+        active = loop_count != 0
+        time += np.where(active, elapsed_time * self._speed[:n], 0.)
+        frame = time * fps
+
+        # 过渡动画播放完毕后回到子动画
+        in_transition = active & (transition >= 0)
+        ended = in_transition & (frame > transition)
+        time[ended] = _mod(time[ended], transition[ended] / fps[ended])
+        transition[ended] = -1
+        ground_valid[ended] = False
+        for slot in np.flatnonzero(ended).tolist():
+            self.players[slot]._end_transition()
+
+        playing = active & ~in_transition
+        wrapped = playing & (frame > max_frame)
+        loop_count[wrapped & (loop_count != -1)] -= 1
+        time[wrapped] = _mod(time[wrapped], max_frame[wrapped] / fps[wrapped])
+        ground_valid[wrapped] = False
+        finished = wrapped & (loop_count == 0)
+
+        moved = np.zeros(n, np.bool_)
+        ground_dx = np.zeros(n)
+        ground_dy = np.zeros(n)
+        tracking = playing & ~wrapped
+        anim_ids = self._anim[:n]
+        for anim_id in np.unique(anim_ids[tracking]).tolist():
+            ground = self._grounds[anim_id]
+            if ground is None:
+                continue
+            slots = np.flatnonzero(tracking & (anim_ids == anim_id))
+            x, y, hidden = ground.at(self._start[slots] + frame[slots])
+            visible = slots[~hidden]
+            x = x[~hidden]
+            y = y[~hidden]
+            ground_valid[slots[hidden]] = False
+            had_previous = ground_valid[visible]
+            moved[visible] = had_previous
+            ground_dx[visible] = np.where(had_previous, x - self._ground_x[visible], 0.)
+            ground_dy[visible] = np.where(had_previous, y - self._ground_y[visible], 0.)
+            self._ground_x[visible] = x
+            self._ground_y[visible] = y
+            ground_valid[visible] = True
+        return BatchStep(wrapped, finished, moved, ground_dx, ground_dy)
+
+    def emit_ground_moved(self, step: BatchStep) -> None:
+        """对地面轨道移动了的播放器调用其 ground_moved"""
+        players = self.players
+        dx = step.ground_dx
+        dy = step.ground_dy
+        for slot in np.flatnonzero(step.moved).tolist():
+            players[slot].ground_moved(QPointF(dx[slot], dy[slot]))
+
+
+def _mod(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """与 Python 的 % 相同，除数为 0 时结果为 0"""
+    return np.mod(a, b, out=np.zeros_like(a), where=b > 0)
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Callable, Final, Generic, Hashable, TypeVar
+
+__all__ = (
+    'LRUCache',
+    'FRAME_QUANTIZATION',
+)
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+_MISSING: Final = object()
+FRAME_QUANTIZATION: Final = 8  # 每帧细分的份数，按帧号缓存时先取整到细分点
+
+
+class LRUCache(Generic[K, V]):
+    """最近最少使用淘汰的有界缓存，记录命中与未命中次数
+
+    size_of 为 None 时 max_size 限制条目数，否则限制所有条目 size_of 之和（例如字节数）；
+    可以在多个线程中使用（例如导出时的绘制线程）
+    """
+
+    def __init__(self, max_size: int, size_of: Callable[[V], int] | None = None):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._lock = RLock()
+
+    def get_or_create(self, key: K, factory: Callable[[], V]) -> V:
+        data = self._data
+        with self._lock:
+            value = data.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                data.move_to_end(key)
+                return value
+            self.misses += 1
+            value = factory()
+            data[key] = value
+            self.size += self._size_of(value)
+            # 最新的条目总是保留
+            while self.size > self.max_size and len(data) > 1:
+                _, evicted = data.popitem(last=False)
+                self.size -= self._size_of(evicted)
+            return value
+
+    def _size_of(self, value: V) -> int:
+        return 1 if self.size_of is None else self.size_of(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
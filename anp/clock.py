@@ -0,0 +1,69 @@
+from time import perf_counter
+from typing import Final
+from weakref import WeakKeyDictionary
+
+from PySide6.QtWidgets import QGraphicsScene
+
+__all__ = (
+    'MAX_STEP',
+    'SceneClock',
+    'scene_clock',
+)
+
+MAX_STEP: Final = 0.25  # 单位：s
+
+
+class SceneClock:
+    """场景中所有物体共用的时钟，每次 QGraphicsScene.advance 只读取一次 perf_counter
+
+    interval 不为 None 时每次 advance 固定前进 interval 秒，与实际经过的时间无关；
+    scale 为时间的倍率（小于 1 时为慢动作），paused 为 True 时时间停止；
+    frame_step 不为 None 时代替场景中各物体的 AnimationPlayer.frame_step；
+    max_step 为一次 tick 最多前进的真实时间，卡顿或定时器停止后不会一次跳过很多帧
+    """
+
+    def __init__(self, interval: float | None = None):
+        self.interval = interval
+        self.frame_step: int | None = None
+        self.scale = 1.
+        self.max_step = MAX_STEP
+        self.paused = False
+        self.elapsed = 0.  # 最近一次 tick 前进的时间，单位：s
+        self.now = 0.  # 场景开始以来的时间，单位：s
+        self._last = perf_counter()
+        self._ticked = False
+
+    def reset(self) -> None:
+        """从现在开始计时，下一次 tick 不包括此前经过的时间；在启动驱动 advance 的定时器时调用"""
+        self._last = perf_counter()
+        self._ticked = False
+
+    def tick(self) -> float:
+        """读取一次时间并前进，返回前进的时间"""
+        now = perf_counter()
+        real = min(now - self._last, self.max_step) if self.interval is None else self.interval
+        self._last = now
+        self.elapsed = 0. if self.paused else real * self.scale
+        self.now += self.elapsed
+        return self.elapsed
+
+    def advance(self, phase: int) -> float:
+        """在 QGraphicsItem.advance 中调用：第 0 阶段的第一次调用时 tick，第 1 阶段返回本次前进的时间"""
+        if not phase:
+            if not self._ticked:
+                self.tick()
+                self._ticked = True
+            return 0.
+        self._ticked = False
+        return self.elapsed
+
+
+_clocks: 'WeakKeyDictionary[QGraphicsScene, SceneClock]' = WeakKeyDictionary()
+
+
+def scene_clock(scene: QGraphicsScene) -> SceneClock:
+    """scene 的时钟，首次使用时创建"""
+    res = _clocks.get(scene)
+    if res is None:
+        res = _clocks[scene] = SceneClock()
+    return res
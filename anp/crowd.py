@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+
+from PySide6.QtCore import QRectF, QPointF
+from PySide6.QtGui import QPainter
+from PySide6.QtWidgets import QGraphicsItem
+
+from .clock import scene_clock
+from .player import Animation
+
+__all__ = (
+    'CrowdInstance',
+    'CrowdItem',
+)
+
+
+@dataclass
+class CrowdInstance:
+    pos: QPointF
+    clip: str = ''
+    time: float = 0.  # 单位：s
+    speed: float = 1.
+    hide_items: list[str] = field(default_factory=list)
+    z: float = 0.
+
+
+class CrowdItem(QGraphicsItem):
+    """在一个 QGraphicsItem 中绘制同一 Animation 的多个实例，实例按 z 从小到大绘制"""
+
+    def __init__(self, anim: Animation):
+        try:
+            super().__init__()
+        except RuntimeError:
+            pass
+        self.anim = anim
+        self.instances: list[CrowdInstance] = []
+        self._bounds = QRectF()
+
+    def add(self, pos: QPointF, clip: str = '', **kwargs) -> CrowdInstance:
+        instance = CrowdInstance(QPointF(pos), clip, **kwargs)
+        self.instances.append(instance)
+        self.update_geometry()
+        return instance
+
+    def remove(self, instance: CrowdInstance) -> None:
+        self.instances.remove(instance)
+        self.update_geometry()
+
+    def frame_of(self, instance: CrowdInstance) -> float:
+        """实例当前所在的帧（已加上子动画的起始帧）"""
+        anim = self.anim
+        if instance.clip:
+            start, end = anim.sub_anim_frame(instance.clip)
+            max_frame = end - start - 1
+        else:
+            start = 0
+            max_frame = anim.max_frame()
+        frame = instance.time * anim.fps
+        if max_frame > 0:
+            frame %= max_frame
+        return start + frame
+
+    def advance(self, phase: int) -> None:
+        elapsed = scene_clock(self.scene()).advance(phase)
+        if not phase:
+            return
+        if not elapsed or not self.instances:
+            return
+        for instance in self.instances:
+            instance.time += elapsed * instance.speed
+        self.update_geometry()
+        self.update()
+
+    def paint(self, painter: QPainter, _1, _2=None) -> None:
+        anim = self.anim
+        for instance in sorted(self.instances, key=lambda i: i.z):
+            painter.save()
+            painter.translate(instance.pos)
+            anim.paint(self.frame_of(instance), painter, instance.hide_items)
+            painter.restore()
+
+    def boundingRect(self) -> QRectF:
+        return self._bounds
+
+    def update_geometry(self) -> None:
+        """实例增减或移动后重新计算包围盒"""
+        bounds = QRectF()
+        for instance in self.instances:
+            bounds = bounds.united(self.anim.clip_bounding_rect(instance.clip).translated(instance.pos))
+        if bounds != self._bounds:
+            self.prepareGeometryChange()
+            self._bounds = bounds
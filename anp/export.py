@@ -0,0 +1,277 @@
+import json
+from math import ceil
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Final, Iterable, Iterator
+
+import cv2
+import numpy as np
+from PySide6.QtCore import QObject, QRectF, QSize, Signal
+from PySide6.QtGui import QImage, QPainter, Qt
+
+from .player import Animation
+
+__all__ = (
+    'VIDEO_CODECS',
+    'export_frames',
+    'open_video',
+    'render_frames',
+    'qimage_array',
+    'qimage_to_bgr',
+    'write_video',
+    'write_png_sequence',
+    'write_grid_sheet',
+    'VideoExport',
+    'ExportCanceled',
+)
+
+VIDEO_CODECS: Final = {
+    'mp4': 'mp4v',
+    'avi': 'XVID',
+}
+QUEUE_FRAMES: Final = 8  # 绘制线程最多领先编码线程的帧数
+
+
+class ExportCanceled(Exception):
+    pass
+
+
+def export_frames(anim: Animation, fps: float, clip: str = '') -> list[float]:
+    """以每秒 fps 帧导出子动画 clip 时每一帧对应的动画帧号"""
+    if clip:
+        start, end = anim.sub_anim_frame(clip)
+        max_frame = end - start - 1
+    else:
+        start = 0
+        max_frame = anim.max_frame()
+    count = ceil(max_frame / anim.fps * fps)
+    return [start + index * anim.fps / fps for index in range(count)]
+
+
+def render_frames(anim: Animation, frames: Iterable[float], bounding: QRectF,
+                  hide_items: int | Iterable[str] = 0) -> Iterator[QImage]:
+    """依次把各帧绘制到同一张 Format_ARGB32 图片上并返回该图片，使用下一帧前需处理完上一帧
+
+    与查看器一样在预乘格式上绘制，再原地转换为未预乘格式，
+    丢弃 alpha 后与把图片存为 .bmp 再用 cv2.imread 读取的结果相同
+    """
+    mask = anim.hide_mask(hide_items)
+    img = QImage(bounding.size().toSize(), QImage.Format_ARGB32_Premultiplied)
+    offset = -bounding.topLeft()
+    for frame in frames:
+        img.reinterpretAsFormat(QImage.Format_ARGB32_Premultiplied)  # 马上会被清空，不需要转换
+        img.fill(Qt.transparent)
+        painter = QPainter(img)
+        painter.translate(offset)
+        anim.paint(frame, painter, mask)
+        painter.end()
+        img.convertTo(QImage.Format_ARGB32)
+        yield img
+
+
+def qimage_array(img: QImage, writable: bool = False) -> np.ndarray:
+    """不复制地把 32 位 QImage 的像素看作 (高, 宽, 4) 的 BGRA 数组"""
+    width = img.width()
+    height = img.height()
+    bits = img.bits() if writable else img.constBits()
+    return np.frombuffer(bits, np.uint8, img.sizeInBytes()) \
+        .reshape(height, img.bytesPerLine())[:, :width * 4] \
+        .reshape(height, width, 4)
+
+
+def qimage_to_bgr(img: QImage, out: np.ndarray | None = None) -> np.ndarray:
+    """去掉 32 位 QImage 的 alpha 后写入 out"""
+    bgra = qimage_array(img)
+    if out is None:
+        out = np.empty((*bgra.shape[:2], 3), np.uint8)
+    return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+
+
+def open_video(path: str | Path, fps: float, size: QSize) -> cv2.VideoWriter:
+    """编码由扩展名决定，见 VIDEO_CODECS"""
+    path = Path(path)
+    codec = VIDEO_CODECS.get(path.suffix[1:].lower())
+    if codec is None:
+        raise ValueError(f'unsupported video format: {path.suffix}')
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    return cv2.VideoWriter(str(path), fourcc, fps, size.toTuple())
+
+
+def write_video(anim: Animation, path: str | Path, fps: float = 60., clip: str = '') -> int:
+    """把子动画 clip（为空时为整个动画）导出为视频，编码由扩展名决定，见 VIDEO_CODECS；返回帧数"""
+    bounding = anim.clip_bounding_rect(clip)
+    size = bounding.size().toSize()
+    frames = export_frames(anim, fps, clip)
+    writer = open_video(path, fps, size)
+    buffer = np.empty((size.height(), size.width(), 3), np.uint8)
+    try:
+        for img in render_frames(anim, frames, bounding):
+            writer.write(qimage_to_bgr(img, buffer))
+    finally:
+        writer.release()
+    return len(frames)
+
+
+def write_png_sequence(anim: Animation, directory: str | Path, fps: float = 60., clip: str = '') -> int:
+    """把子动画 clip 的每一帧存为 directory 中的 0000.png、0001.png……，返回帧数"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    frames = export_frames(anim, fps, clip)
+    for index, img in enumerate(render_frames(anim, frames, anim.clip_bounding_rect(clip))):
+        if not img.save(str(directory / f'{index:04d}.png')):
+            raise OSError(f'cannot write {directory / f"{index:04d}.png"}')
+    return len(frames)
+
+
+def write_grid_sheet(anim: Animation, path: str | Path, fps: float = 60., clip: str = '') -> int:
+    """把子动画 clip 的每一帧按行排列在一张图片中，每格大小相同；帧的信息写入同名的 .json，返回帧数"""
+    path = Path(path)
+    frames = export_frames(anim, fps, clip)
+    bounding = anim.clip_bounding_rect(clip)
+    width = max(ceil(bounding.width()), 1)
+    height = max(ceil(bounding.height()), 1)
+    columns = max(ceil(len(frames) ** .5), 1)
+    rows = max(ceil(len(frames) / columns), 1)
+    sheet = QImage(width * columns, height * rows, QImage.Format_ARGB32)
+    sheet.fill(Qt.transparent)
+    pixels = qimage_array(sheet, True)
+    for index, img in enumerate(render_frames(anim, frames, bounding)):
+        row, column = divmod(index, columns)
+        frame = qimage_array(img)
+        pixels[row * height: row * height + frame.shape[0], column * width: column * width + frame.shape[1]] = frame
+    del pixels
+    if not sheet.save(str(path)):
+        raise OSError(f'cannot write {path}')
+    path.with_suffix('.json').write_text(json.dumps({
+        'image': path.name,
+        'fps': fps,
+        'frame_width': width,
+        'frame_height': height,
+        'columns': columns,
+        'frame_count': len(frames),
+        'origin': [-bounding.x(), -bounding.y()],  # 动画坐标原点在格子中的位置
+    }, indent=2), 'utf-8')
+    return len(frames)
+
+
+class VideoExport(QObject):
+    """在后台导出视频：一个线程绘制，一个线程编码，两者之间是有界队列，通过信号报告进度
+
+    source 不为 None 时 start 从 source 重新加载一份只供导出使用的动画，附件动画也重新加载，不与查看器共享，
+    导出期间可以继续播放 anim；为 None 时直接使用 anim，导出期间不能在其他线程中绘制它。
+    start 在 GUI 线程中把所有图片加载为 QImage 并算好包围盒，绘制线程不使用 QPixmap；
+    source 不为 None 且帧数较多时改用 parallel.write_video_parallel
+    """
+    progress = Signal(int, int)  # 已编码帧数, 总帧数
+    finished = Signal(str)  # 输出文件
+    failed = Signal(str)  # 错误信息
+    canceled = Signal()
+
+    def __init__(self, anim: Animation, path: str | Path, fps: float = 60., clip: str = '',
+                 source: Path | None = None, parent: QObject | None = None):
+        super().__init__(parent)
+        self.anim = anim
+        self.path = Path(path)
+        self.fps = fps
+        self.clip = clip
+        self.source = source
+        self._anim = anim  # 导出线程使用的动画
+        self._bounding = QRectF()
+        self._cancel = Event()
+        self._failed = False
+        self._threads: list[Thread] = []
+
+    def start(self) -> None:
+        from .parallel import PARALLEL_MIN_FRAMES
+        if self.source is not None:
+            from Resources import Resources
+            self._anim = Resources.instance().load_reanim_private(Path(self.source))
+        self._anim.resolve_images(True)
+        self._bounding = self._anim.clip_bounding_rect(self.clip)
+        frames = export_frames(self._anim, self.fps, self.clip)
+        if self.source is not None and len(frames) >= PARALLEL_MIN_FRAMES:
+            self._threads = [Thread(target=self._run_parallel, name='video export', daemon=True)]
+        else:
+            queue: Queue[np.ndarray | None] = Queue(QUEUE_FRAMES)
+            self._threads = [
+                Thread(target=self._render, args=(frames, queue), name='video render', daemon=True),
+                Thread(target=self._encode, args=(len(frames), queue), name='video encode', daemon=True),
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def wait(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _render(self, frames: list[float], queue: 'Queue[np.ndarray | None]') -> None:
+        try:
+            for img in render_frames(self._anim, frames, self._bounding):
+                if not self._put(queue, qimage_to_bgr(img)):
+                    return
+            self._put(queue, None)
+        except Exception as e:
+            self._fail(e)
+
+    def _encode(self, total: int, queue: 'Queue[np.ndarray | None]') -> None:
+        size = self._bounding.size().toSize()
+        written = 0
+        try:
+            writer = open_video(self.path, self.fps, size)
+            try:
+                while (frame := self._get(queue)) is not None:
+                    writer.write(frame)
+                    written += 1
+                    self.progress.emit(written, total)
+            finally:
+                writer.release()
+        except Exception as e:
+            self._fail(e)
+        self._done(written == total and not self._cancel.is_set())
+
+    def _run_parallel(self) -> None:
+        from .parallel import write_video_parallel
+        try:
+            write_video_parallel(self._anim, self.source, self.path, self.fps, self.clip,
+                                 on_progress=self.progress.emit, cancel=self._cancel)
+        except ExportCanceled:
+            pass
+        except Exception as e:
+            self._fail(e)
+        self._done(not self._cancel.is_set())
+
+    def _put(self, queue: 'Queue[np.ndarray | None]', frame: np.ndarray | None) -> bool:
+        """队列满时等待，取消后返回 False"""
+        while not self._cancel.is_set():
+            try:
+                queue.put(frame, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _get(self, queue: 'Queue[np.ndarray | None]') -> np.ndarray | None:
+        """队列空时等待，取消后返回 None"""
+        while not self._cancel.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+        return None
+
+    def _fail(self, error: Exception) -> None:
+        self._failed = True
+        self._cancel.set()
+        self.failed.emit(str(error))
+
+    def _done(self, complete: bool) -> None:
+        if complete:
+            self.finished.emit(str(self.path))
+            return
+        self.path.unlink(missing_ok=True)  # 不保留未完成的文件
+        if not self._failed:
+            self.canceled.emit()
@@ -0,0 +1,165 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from queue import Queue
+from threading import Event, Thread
+from typing import Callable, Final, NamedTuple
+
+import numpy as np
+from PySide6.QtCore import QRectF
+
+from .export import ExportCanceled, export_frames, open_video, qimage_to_bgr, render_frames
+from .player import Animation
+
+__all__ = (
+    'CHUNK_FRAMES',
+    'PARALLEL_MIN_FRAMES',
+    'init_offscreen',
+    'write_video_parallel',
+)
+
+CHUNK_FRAMES: Final = 16  # 每个任务绘制的帧数
+PARALLEL_MIN_FRAMES: Final = 600  # 启动子进程约需 1～2 秒，帧数较少时直接用 export.write_video 更快
+
+
+class _WorkerSetup(NamedTuple):
+    """子进程重新加载动画所需的信息，均可以 pickle"""
+    source: Path  # .reanim 文件
+    resources_root: Path
+    properties: dict[str, dict[str, Path]]
+    reanim_cache_dir: Path | None
+    bounding: tuple[float, float, float, float]
+    hide_mask: int
+
+
+class _Slot:
+    """一块可以容纳 CHUNK_FRAMES 帧 BGR 图像的共享内存"""
+
+    def __init__(self, shape: tuple[int, int, int, int]):
+        self.shape = shape
+        self.memory = SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+        self.frames = np.ndarray(shape, np.uint8, self.memory.buf)
+
+    def close(self) -> None:
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+def write_video_parallel(anim: Animation, source: Path, path: str | Path, fps: float = 60., clip: str = '',
+                         hide_items: int | list[str] = 0, workers: int | None = None,
+                         on_progress: Callable[[int, int], None] | None = None, cancel: Event | None = None) -> None:
+    """与 export.write_video 结果相同，但由多个进程分段绘制，当前线程只负责分配任务，另一线程按顺序编码
+
+    source 为 anim 的 .reanim 文件，子进程用当前的 Resources 设置重新加载它；
+    on_progress(已编码帧数, 总帧数) 在编码线程中调用；cancel 被设置后停止并抛出 ExportCanceled
+    """
+    import Resources
+    resources = Resources.Resources.instance()
+    bounding = anim.clip_bounding_rect(clip)
+    size = bounding.size().toSize()
+    setup = _WorkerSetup(
+        Path(source).resolve(),
+        Path(Resources.resources_root).resolve(),
+        resources.prop_all,
+        resources.reanim_cache_dir,
+        (bounding.x(), bounding.y(), bounding.width(), bounding.height()),
+        anim.hide_mask(hide_items),
+    )
+    frames = export_frames(anim, fps, clip)
+    chunks = [frames[i: i + CHUNK_FRAMES] for i in range(0, len(frames), CHUNK_FRAMES)]
+    workers = workers or os.cpu_count() or 1
+
+    writer = open_video(path, fps, size)
+    shape = (CHUNK_FRAMES, size.height(), size.width(), 3)
+    slots = [_Slot(shape) for _ in range(min(workers * 2, len(chunks)))]
+    free: Queue[_Slot] = Queue()
+    for slot in slots:
+        free.put(slot)
+    pending: Queue[tuple[_Slot, Future[int]] | None] = Queue()
+    errors: list[BaseException] = []
+
+    def write() -> None:
+        written = 0
+        while (task := pending.get()) is not None:
+            slot, future = task
+            try:
+                if cancel is not None and cancel.is_set():
+                    raise ExportCanceled()
+                if not errors:
+                    for frame in slot.frames[:future.result()]:
+                        writer.write(frame)
+                        written += 1
+                    if on_progress is not None:
+                        on_progress(written, len(frames))
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                free.put(slot)
+
+    # spawn：子进程不继承已初始化的 Qt
+    with ProcessPoolExecutor(workers, get_context('spawn'), _init_worker, (setup,)) as pool:
+        thread = Thread(target=write, name='video writer')
+        thread.start()
+        try:
+            for chunk in chunks:
+                slot = free.get()
+                if errors:
+                    free.put(slot)
+                    break
+                pending.put((slot, pool.submit(_render_chunk, slot.memory.name, slot.shape, chunk)))
+        finally:
+            pending.put(None)
+            thread.join()
+            writer.release()
+            for slot in slots:
+                slot.close()
+    if errors:
+        raise errors[0]
+
+
+# 子进程中的状态
+_app = None
+_anim: Animation | None = None
+_setup: _WorkerSetup | None = None
+
+
+def init_offscreen(resources_root: Path, properties: dict[str, dict[str, Path]], reanim_cache_dir: Path | None) \
+        -> None:
+    """在子进程中创建无界面的 QGuiApplication 并设置 Resources"""
+    global _app
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    from PySide6.QtGui import QGuiApplication
+    if QGuiApplication.instance() is None:
+        _app = QGuiApplication([])
+    import Resources
+    Resources.resources_root = resources_root
+    resources = Resources.Resources.instance()
+    resources.prop_all = properties
+    resources.reanim_cache_dir = reanim_cache_dir
+
+
+def _init_worker(setup: _WorkerSetup) -> None:
+    global _anim, _setup
+    init_offscreen(setup.resources_root, setup.properties, setup.reanim_cache_dir)
+    import Resources
+    _anim = Resources.Resources.instance().load_reanim(setup.source)
+    _anim.resolve_images()
+    _setup = setup
+
+
+def _render_chunk(memory_name: str, shape: tuple[int, int, int, int], frames: list[float]) -> int:
+    """把 frames 依次绘制到共享内存 memory_name 中，返回绘制的帧数"""
+    assert _anim is not None and _setup is not None
+    memory = SharedMemory(memory_name)
+    try:
+        out = np.ndarray(shape, np.uint8, memory.buf)
+        images = render_frames(_anim, frames, QRectF(*_setup.bounding), _setup.hide_mask)
+        for index, img in enumerate(images):
+            qimage_to_bgr(img, out[index])
+        del out
+    finally:
+        memory.close()
+    return len(frames)
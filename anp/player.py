@@ -1,21 +1,32 @@
 from abc import abstractmethod, ABCMeta
+from bisect import bisect_right
 from dataclasses import dataclass
-from math import cos, sin, radians
+from math import cos, sin, radians, floor
 from pathlib import Path
-from typing import Callable, TypeVar, cast, Any, TYPE_CHECKING, Final, overload
+from sys import getsizeof
+from typing import Callable, cast, Any, TYPE_CHECKING, Final, overload, Generic, TypeVar, Iterable
 from xml.etree.ElementTree import Element, tostring
 
 import mypy_extensions
-from PySide6.QtCore import QPointF, QPoint, QRect, QRectF
-from PySide6.QtGui import QPixmap, QPainter, QTransform, Qt
+import numpy as np
+from PySide6.QtCore import QPointF, QPoint, QRect, QRectF, QSize
+from PySide6.QtGui import QPixmap, QPainter, QTransform, Qt, QImage
 
-from Resources import Resources, parse_xml
+from Resources import Resources, parse_xml, iterparse_xml
+from .cache import LRUCache, FRAME_QUANTIZATION
 
 if TYPE_CHECKING:
     from typing_extensions import Self
+    from .tracks import TrackTable, TrackState
+    from .batch import PlayerBatch
 
-real = TypeVar('real', int, float)
+T = TypeVar('T')
 ATTACH: Final = 'attacher__'
+STREAMING_MIN_SIZE: Final = 1 << 20  # 字节，不小于该大小的文件默认边读边解析
+STATE_CACHE_SIZE: Final = 4 << 20  # 字节，每个动画缓存的量化帧插值结果的总大小
+BOUNDS_CACHE_SIZE: Final = 1024  # 每个动画缓存的量化帧包围盒数
+CLIP_MARGIN: Final = 2  # 像素，见 Animation.clip_bounding_rect
+MAX_ROTATION_STEP: Final = 15.  # 度，计算子动画包围盒时相邻取样点间旋转角的最大变化量
 
 
 class Animation:
@@ -26,39 +37,200 @@ class Animation:
             items = []
         self.fps = fps
         self._items: list[Item] = items
-
-    def paint(self, frame: float, painter: QPainter, hide_items: list[str]):
-        for item in self._items:
-            if item.name in hide_items:
+        for item in items:
+            item.owner = self
+        self.version = 0  # 每次 invalidate 加一，用作共享缓存键的一部分
+        self._tracks: 'TrackTable | None' = None
+        self._max_frame: int | None = None
+        self._sub_anims: dict[str, tuple[int, int]] | None = None  # name: (start, end)
+        self._frame_bounds: list[QRectF] | None = None
+        self._inner_bounds: list[QRectF] | None = None
+        self._clip_bounds: dict[str, QRectF] = {}
+        self._name_masks: dict[str, int] | None = None  # name: 同名轨道下标的位掩码
+        # 量化帧号（帧号 * FRAME_QUANTIZATION）: TrackState 与 (量化帧号, 隐藏掩码): QRectF，
+        # 同一动画的多个播放器在相同的帧上共用
+        self.state_cache: 'LRUCache[int, TrackState]' = LRUCache(STATE_CACHE_SIZE, _state_size)
+        self.bounds_cache: LRUCache[tuple[int, int], QRectF] = LRUCache(BOUNDS_CACHE_SIZE)
+
+    def invalidate(self) -> None:
+        """清除由轨道和关键帧推导出的缓存，ItemWithData.set_data_at 等修改数据的方法会自动调用；
+        直接修改 _items 后需手动调用"""
+        self.version += 1
+        self._tracks = None
+        self._max_frame = None
+        self._sub_anims = None
+        self._frame_bounds = None
+        self._inner_bounds = None
+        self._clip_bounds = {}
+        self._name_masks = None
+        self.state_cache = LRUCache(STATE_CACHE_SIZE, _state_size)
+        self.bounds_cache = LRUCache(BOUNDS_CACHE_SIZE)
+
+    def tracks(self) -> 'TrackTable':
+        """各轨道按帧展开的数组表示，首次使用时生成"""
+        if self._tracks is None:
+            from .tracks import TrackTable
+            self._tracks = TrackTable.from_items(self._items, self.max_frame() + 1)
+        return self._tracks
+
+    def evaluate(self, frame: float) -> 'TrackState':
+        """落在量化点上的帧使用 state_cache，返回的 TrackState 不要修改"""
+        key = frame * FRAME_QUANTIZATION
+        if key != int(key):
+            return self.tracks().evaluate(frame)
+        return self.state_cache.get_or_create(int(key), lambda: self.tracks().evaluate(frame))
+
+    def paint(self, frame: float, painter: QPainter, hide_items: int | Iterable[str]):
+        """hide_items 为要隐藏的轨道名，或由 hide_mask 得到的位掩码"""
+        mask = self.hide_mask(hide_items)
+        state = self.evaluate(frame)
+        for index, item in enumerate(self._items):
+            if mask >> index & 1:
                 continue
             painter.save()
-            item.paint(frame, painter)
+            item.paint_evaluated(frame, painter, state, index)
             painter.restore()
 
-    def bounding_rect_at(self, frame: float, hide_items: list[str]) -> QRectF:
+    def bounding_rect_at(self, frame: float, hide_items: int | Iterable[str]) -> QRectF:
+        """落在量化点上的帧使用 bounds_cache"""
+        mask = self.hide_mask(hide_items)
+        key = frame * FRAME_QUANTIZATION
+        if key != int(key):
+            return self._bounding_rect_at(frame, mask)
+        return QRectF(self.bounds_cache.get_or_create((int(key), mask), lambda: self._bounding_rect_at(frame, mask)))
+
+    def _bounding_rect_at(self, frame: float, mask: int) -> QRectF:
+        state = self.evaluate(frame)
+        indices = []
+        sizes = []
         points = []
-        for item in self._items:
-            if item.name in hide_items:
+        for index, item in enumerate(self._items):
+            if mask >> index & 1:
+                continue
+            if isinstance(item, NormalItem):
+                if state.hidden[index]:
+                    continue
+                size = item.image_size_at(frame)
+                if size is None or size.isEmpty():
+                    continue
+                indices.append(index)
+                sizes.append((size.width() - 1, size.height() - 1))  # QRect 的右下角
                 continue
             bounding = item.bounding_rect_at(frame)
             if bounding is None or bounding.isNull():
                 continue
             points.append(bounding.topLeft())
-            points.append(bounding.topRight())
             points.append(bounding.bottomRight())
-            points.append(bounding.bottomLeft())
+        if indices:
+            # 与 QTransform.map 一致：原点按浮点映射，其余三个 QPoint 角映射后取整
+            matrices = state.matrices[indices]
+            w, h = np.array(sizes, np.float64).T
+            zeros = np.zeros_like(w)
+            u = np.stack((w, zeros, w))
+            v = np.stack((zeros, h, h))
+            xs = _round(matrices[:, 0, 0] * u + matrices[:, 0, 1] * v + matrices[:, 0, 2])
+            ys = _round(matrices[:, 1, 0] * u + matrices[:, 1, 1] * v + matrices[:, 1, 2])
+            xs = np.vstack((matrices[:, 0, 2], xs))
+            ys = np.vstack((matrices[:, 1, 2], ys))
+            min_x, max_x = xs.min(axis=0), xs.max(axis=0)
+            min_y, max_y = ys.min(axis=0), ys.max(axis=0)
+            not_null = (min_x != max_x) | (min_y != max_y)
+            if not_null.any():
+                points.append(QPointF(float(min_x[not_null].min()), float(min_y[not_null].min())))
+                points.append(QPointF(float(max_x[not_null].max()), float(max_y[not_null].max())))
         return bounding_rect(points)
 
-    def max_frame(self):
-        if not self._items:
-            return 0
-        return max(item.max_frame() for item in self._items)
+    def frame_bounds(self) -> list[QRectF]:
+        """每个整数帧不隐藏任何轨道时的包围盒"""
+        if self._frame_bounds is None:
+            self._frame_bounds = [self.bounding_rect_at(frame, 0) for frame in range(self.max_frame() + 1)]
+        return self._frame_bounds
+
+    def _inner_frame_bounds(self) -> list[QRectF]:
+        """每两个相邻整数帧之间插值帧的包围盒，按区间内旋转角的最大变化量取样，至少取中点"""
+        if self._inner_bounds is None:
+            table = self.tracks()
+            rotate = np.stack((table.field('x_rotate'), table.field('y_rotate'))).astype(np.float64)
+            delta = np.abs(np.diff(rotate, axis=2)).max(axis=(0, 1), initial=0.)
+            counts = np.maximum(np.ceil(delta / MAX_ROTATION_STEP), 2).astype(np.int64).tolist()
+            self._inner_bounds = []
+            for frame, count in enumerate(counts[:self.max_frame()]):
+                res = QRectF()
+                for k in range(1, count):
+                    res = res.united(self.bounding_rect_at(frame + k / count, 0))
+                self._inner_bounds.append(res)
+        return self._inner_bounds
+
+    def clip_bounding_rect(self, name: str = '') -> QRectF:
+        """子动画 name 所有帧（含插值帧）的包围盒，name 为空时表示整个动画
+
+        取整数帧与帧间取样点的包围盒的并集，再向四周扩大 CLIP_MARGIN，覆盖旋转插值时部件的角在取样点之间划出的弧线
+        """
+        if name in self._clip_bounds:
+            return self._clip_bounds[name]
+        if name:
+            start, end = self.sub_anim_frame(name)
+        else:
+            start, end = 0, self.max_frame() + 1
+        res = QRectF()
+        for bounding in self.frame_bounds()[start:end] + self._inner_frame_bounds()[start:end - 1]:
+            res = res.united(bounding)
+        if not res.isNull():
+            res.adjust(-CLIP_MARGIN, -CLIP_MARGIN, CLIP_MARGIN, CLIP_MARGIN)
+        self._clip_bounds[name] = res
+        return res
+
+    def resolve_images(self, qimage: bool = False) -> None:
+        """在 GUI 线程中一次性加载所有轨道的图片，之后绘制时不再读取文件；
+        qimage 为 True 时加载为 QImage，之后可以在其他线程中绘制"""
+        for item in self._items:
+            item.resolve_images(qimage)
 
-    def find_item_by_name(self, name: str) -> 'Item | None':
+    def memory_usage(self) -> int:
+        """所有轨道关键帧数据（去重后）占用的字节数"""
+        seen: dict[int, ItemData] = {}
         for item in self._items:
-            if item.name == name:
-                return item
-        return None
+            if isinstance(item, ItemWithData):
+                for _, data in item.keyframes():
+                    seen[id(data)] = data
+            elif isinstance(item, SingleAttachItem):
+                seen[id(item.data)] = item.data
+        return sum(getsizeof(data) for data in seen.values())
+
+    def max_frame(self) -> int:
+        if self._max_frame is None:
+            self._max_frame = max((item.max_frame() for item in self._items), default=0)
+        return self._max_frame
+
+    def find_item_by_name(self, name: str) -> 'Item | None':
+        index = self.item_index(name)
+        return None if index < 0 else self._items[index]
+
+    def item_index(self, name: str) -> int:
+        """第一条名为 name 的轨道的下标，不存在时为 -1"""
+        mask = self.name_masks().get(name, 0)
+        return (mask & -mask).bit_length() - 1
+
+    def name_masks(self) -> dict[str, int]:
+        """轨道名到同名轨道下标位掩码的映射，首次使用时生成"""
+        if self._name_masks is None:
+            masks: dict[str, int] = {}
+            for index, item in enumerate(self._items):
+                masks[item.name] = masks.get(item.name, 0) | 1 << index
+            self._name_masks = masks
+        return self._name_masks
+
+    def hide_mask(self, names: int | str | Iterable[str]) -> int:
+        """把要隐藏的轨道名转换为轨道下标的位掩码，已经是位掩码时原样返回；单个 str 视为一个轨道名"""
+        if isinstance(names, int):
+            return names
+        if isinstance(names, str):
+            names = (names,)
+        masks = self.name_masks()
+        res = 0
+        for name in names:
+            res |= masks.get(name, 0)
+        return res
 
     @overload
     def internal_to(self, frame: float, guide_name: str, /) -> 'Animation': ...
@@ -70,31 +242,54 @@ class Animation:
             end, _ = self.sub_anim_frame(guide_name)
         else:
             end = guide_name
-        res = Animation()
-        res.fps = self.fps
         items = []
         for item in self._items:
             new_item = item.internal_to(frame, end)
             items.append(new_item)
-        res._items = items
-        return res
-
-    def sub_anim_frame(self, name: str):  # 切片表示法
-        guide_item: NormalItem = cast(NormalItem, self.find_item_by_name(name))
-        if guide_item is None:
+        return Animation(self.fps, items)
+
+    def sub_anim_frame(self, name: str) -> tuple[int, int]:  # 切片表示法
+        sub_anims = self.sub_anim_index()
+        if name not in sub_anims:
+            sub_anims[name] = self._calc_sub_anim_frame(name)
+        return sub_anims[name]
+
+    def sub_anim_index(self) -> dict[str, tuple[int, int]]:
+        """所有引导轨道（不含图片的普通轨道）的 name: (start, end)"""
+        if self._sub_anims is None:
+            self._sub_anims = {
+                item.name: self._calc_sub_anim_frame(item.name)
+                for item in self._items
+                if isinstance(item, NormalItem) and item.is_guide()
+            }
+        return self._sub_anims
+
+    def clip_names(self) -> list[str]:
+        """可以单独播放的子动画：引导轨道中范围非空且不是整个动画的，
+        不含以 _ 开头的轨道（例如 _ground）与不附加动画的 attacher__ 轨道"""
+        whole = (0, self.max_frame() + 1)
+        return [
+            name for name, (start, end) in self.sub_anim_index().items()
+            if not name.startswith(('_', ATTACH)) and start < end and (start, end) != whole
+        ]
+
+    def _calc_sub_anim_frame(self, name: str) -> tuple[int, int]:
+        guide_item = self.find_item_by_name(name)
+        if not isinstance(guide_item, ItemWithData):
             return 0, 0
         max_frame = self.max_frame() + 1
+        # 只遍历隐藏标记变化的帧，不需要按帧展开的 TrackTable
+        steps = guide_item.hidden_steps()
         if guide_item.hidden_at(0):
-            start = 1
-            for start in range(1, max_frame):
-                if not guide_item.hidden_at(start):
-                    break
+            start = next((frame for frame, hidden in zip(steps.starts, steps.values) if not hidden),
+                         max(max_frame - 1, 1))
         else:
             start = 0
-        for frame in range(start, max_frame):
-            if guide_item.hidden_at(frame):
-                return start, frame
-        return start, max_frame
+        if guide_item.hidden_at(start):
+            return start, start
+        end = next((frame for frame, hidden in zip(steps.starts, steps.values) if hidden and frame > start),
+                   max_frame)
+        return start, end
 
     def load_img0(self, guide_name: str = '', hide_items: list[str] | None = None) -> QPixmap:
         if hide_items is None:
@@ -121,9 +316,15 @@ class Animation:
 
 class Reanim(Animation):
     @staticmethod
-    def load(path: Path | str):
+    def load(path: Path | str, streaming: bool | None = None):
+        """streaming 为 True 时边读边解析，不在内存中保留整棵 XML 树，峰值内存更小但更慢；
+        为 None 时只对不小于 STREAMING_MIN_SIZE 的文件使用"""
         if not isinstance(path, Path):
             path = Path(path)
+        if streaming is None:
+            streaming = path.stat().st_size >= STREAMING_MIN_SIZE
+        if streaming:
+            return _ReanimCalculator(None, path.parent).stream(path)
         root = parse_xml(path)
         calc = _ReanimCalculator(root, path.parent)
         return calc.start()
@@ -150,27 +351,78 @@ class Reanim(Animation):
 class _ReanimCalculator:
     fps: float
 
-    def __init__(self, tree: Element, root: Path):
+    def __init__(self, tree: Element | None, root: Path):
         self.tree = tree
         self.root = root
         self._attach = False
 
     def start(self):
+        assert self.tree is not None
         fps = float(self.tree[0].text)  # float?
         self.fps = fps
         items = []
         for child in self.tree[1:]:
             item = self.track(child)
             items.append(item)
-        return Reanim(fps, items)
+        return self.reanim(items)
+
+    def stream(self, path: Path) -> 'Reanim':
+        """与 start 结果相同，但每读完一帧就把对应的元素清空"""
+        items = []
+        top: Element | None = None
+        depth = 0
+        has_fps = False
+        name = ''
+        frames: list[dict[str, Any]] = []
+        held = True
+        for event, element in iterparse_xml(path):
+            if event == 'start':
+                if top is None:
+                    top = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 2:  # track 的子元素
+                if element.tag == 'name':
+                    name = element.text
+                    assert name is not None
+                elif element.tag == 't':
+                    if frames and len(element):
+                        held = False
+                    frames.append(self.frame(element))
+                    element.clear()
+            elif depth == 1:  # 顶层元素
+                if not has_fps:
+                    self.fps = float(element.text)
+                    has_fps = True
+                else:
+                    assert element.tag == 'track'
+                    items.append(self.track_from_frames(name, frames, held))
+                    frames = []
+                    held = True
+                assert top is not None
+                top.clear()
+        return self.reanim(items)
+
+    def reanim(self, items: list['ReanimItem']) -> 'Reanim':
+        res = Reanim(self.fps, items)
+        res.sub_anim_index()  # 只用到引导轨道的隐藏标记，TrackTable 在首次 evaluate 时才生成
+        return res
 
     def track(self, tree: Element) -> 'ReanimItem':
         assert tree.tag == 'track'
-        is_attach, name = self.is_attach(tree)
+        name = tree[0].text
+        assert name is not None
+        frames = [self.frame(child) for child in tree[1:]]
+        return self.track_from_frames(name, frames, not any(i for i in tree[2:]))
+
+    def track_from_frames(self, name: str, frames: list[dict[str, Any]], held: bool) -> 'ReanimItem':
+        """held：第一帧之后的帧都没有子元素"""
+        is_attach, name = self.is_attach(name, frames)
         res: ReanimItemWithData
         if is_attach:
-            if not any(i for i in tree[2:]):
-                return ReanimSingleAttachItem(name, ItemData().updated(self.frame(tree[1])), self.fps)
+            if held:
+                return ReanimSingleAttachItem(name, ItemData().updated(frames[0]), self.fps)
             else:
                 res = ReanimAttacherItem(name, self.fps)
             self._attach = True
@@ -179,11 +431,11 @@ class _ReanimCalculator:
             self._attach = False
         frame = 0
         raw = ItemData()
-        for child in tree[1:]:
-            data = self.frame(child)
+        for data in frames:
             raw = raw.updated(data)
             res.set_data_at(raw, frame)
             frame += 1
+        res.build_index()
         res.read_complete_recall()
         return res
 
@@ -195,7 +447,6 @@ class _ReanimCalculator:
             if inner is None:
                 if child.tag == 'i':
                     res['image_name'] = ''
-                    res['image'] = None
                 continue
             match child.tag:
                 case 'x':
@@ -214,8 +465,6 @@ class _ReanimCalculator:
                     res['opacity'] = float(inner)
                 case 'i':
                     res['image_name'] = inner
-                    img = Resources.instance().load_pixmap(inner)
-                    res['image'] = img
                 case 'f':
                     if inner == '-1':
                         res['hidden'] = True
@@ -225,20 +474,13 @@ class _ReanimCalculator:
                     res['text'] = inner
         return res
 
-    def is_attach(self, tree: Element) -> tuple[bool, str]:
-        assert tree.tag == 'track'
-        name = tree[0].text
-        assert name is not None
+    @staticmethod
+    def is_attach(name: str, frames: list[dict[str, Any]]) -> tuple[bool, str]:
         if not name.startswith(ATTACH):
             return False, name
-        for child in tree[1:]:
-            assert child.tag == 't'
-            for cc in child:
-                if cc.tag == 'text':
-                    text = cc.text
-                    assert text is not None
-                    if text.startswith(ATTACH):
-                        return True, name[len(ATTACH):]
+        for data in frames:
+            if data.get('text', '').startswith(ATTACH):
+                return True, name[len(ATTACH):]
         return False, name
 
 
@@ -247,6 +489,7 @@ class Item:
 
     def __init__(self, name: str):
         self.name = name
+        self.owner: Animation | None = None  # 所属的动画，数据被修改时通知它清除缓存
 
     @abstractmethod
     def paint(self, frame: float, painter: QPainter) -> None: pass
@@ -257,6 +500,17 @@ class Item:
     @abstractmethod
     def internal_to(self, start: float, end: float) -> 'Self': ...
 
+    def resolve_images(self, qimage: bool = False) -> None:
+        """提前加载绘制时需要的图片，见 Animation.resolve_images"""
+
+    def _changed(self) -> None:
+        if self.owner is not None:
+            self.owner.invalidate()
+
+    def paint_evaluated(self, frame: float, painter: QPainter, state: 'TrackState', index: int) -> None:
+        """使用 Animation.evaluate 预先算好的数据绘制，index 是本轨道在 state 中的下标"""
+        self.paint(frame, painter)
+
 
 @mypy_extensions.trait
 class ReanimItem(Item, metaclass=ABCMeta):
@@ -270,32 +524,73 @@ class ItemWithData(Item, metaclass=ABCMeta):
     def __init__(self, name: str = ''):
         super().__init__(name)
         self._data: dict[int, ItemData] = {}
+        # 关键帧索引：按帧号排序的帧数组与对应的数据数组，为 None 时需要重建
+        self._frames: list[int] | None = None
+        self._values: list[ItemData] = []
+        self._hidden_steps = StepTable(False)
 
     def set_data_at(self, data: 'ItemData', frame: int):
         self._data[frame] = data
+        self._frames = None
+        self._changed()
+
+    def set_frames(self, values: list['ItemData']) -> None:
+        """把第 0、1、2……帧的数据依次设为 values，代替逐帧调用 set_data_at"""
+        self._data = dict(enumerate(values))
+        self._frames = None
+        self._changed()
+
+    def build_index(self) -> None:
+        frames = sorted(self._data.keys())
+        self._values = [self._data[frame] for frame in frames]
+        self._frames = frames
+        self._hidden_steps = StepTable(False, ((frame, data.hidden) for frame, data in zip(frames, self._values)))
+
+    def hidden_steps(self) -> 'StepTable[bool]':
+        """隐藏标记的阶梯函数"""
+        if self._frames is None:
+            self.build_index()
+        return self._hidden_steps
+
+    def keyframes(self) -> list[tuple[int, 'ItemData']]:
+        """按帧号排序的 (帧号, 数据)"""
+        if self._frames is None:
+            self.build_index()
+        return list(zip(self._frames, self._values))
+
+    def _key_index(self, frame: float) -> int:
+        """返回不晚于 frame 的最后一个关键帧在索引中的位置"""
+        if self._frames is None:
+            self.build_index()
+        return max(bisect_right(self._frames, frame) - 1, 0)
+
+    def _key_range(self, frame: float) -> tuple['ItemData', 'ItemData', float]:
+        i = self._key_index(frame)
+        frames = self._frames
+        a = frames[i]
+        if a >= frame or i + 1 == len(frames):
+            data = self._values[i]
+            return data, data, 0.
+        return self._values[i], self._values[i + 1], (frame - a) / (frames[i + 1] - a)
 
     def data_at(self, frame: float) -> 'ItemData':
-        if int(frame) == frame and int(frame) in self._data.keys():
-            return self._data[int(frame)]
-        a, b = find_range(list(self._data.keys()), frame)
-        progress = (frame - a) / (b - a)
-        return self._data[a].interpolated(self._data[b], progress)
+        data_a, data_b, progress = self._key_range(frame)
+        if not progress:
+            return data_a
+        return data_a.interpolated(data_b, progress)
 
     def transform_at(self, frame: float):
         return self.data_at(frame).to_transform()
 
     def hidden_at(self, frame: float) -> bool:
-        f = max(i for i in self._data.keys() if i <= frame)
-        return self._data[f].hidden
+        if self._frames is None:
+            self.build_index()
+        return self._hidden_steps.at(max(frame, self._frames[0]))
 
     def pos_at(self, frame: float):
-        if int(frame) == frame and int(frame) in self._data.keys():
-            data = self._data[int(frame)]
-            return QPointF(data.x, data.y)
-        a, b = find_range(list(self._data.keys()), frame)
-        progress = (frame - a) / (b - a)
-        data_a = self._data[a]
-        data_b = self._data[b]
+        data_a, data_b, progress = self._key_range(frame)
+        if not progress:
+            return QPointF(data_a.x, data_a.y)
         x = interpolated(data_a.x, data_b.x, progress)
         y = interpolated(data_a.y, data_b.y, progress)
         return QPointF(x, y)
@@ -304,7 +599,9 @@ class ItemWithData(Item, metaclass=ABCMeta):
         return self.data_at(frame).opacity
 
     def max_frame(self) -> int:
-        return max(self._data.keys())
+        if self._frames is None:
+            self.build_index()
+        return self._frames[-1]
 
 
 @mypy_extensions.trait
@@ -349,6 +646,15 @@ class ReanimItemWithData(ItemWithData, ReanimItem, metaclass=ABCMeta):
 class NormalItem(ItemWithData, metaclass=ABCMeta):
     def __init__(self, name: str = ''):
         super().__init__(name)
+        self._image_steps: StepTable[str] = StepTable('')
+        self._pixmaps: list[QPixmap | QImage | None] = []  # 与 _image_steps 对应，首次绘制时才加载
+
+    def build_index(self) -> None:
+        super().build_index()
+        # 每帧使用不晚于该帧的最后一张图片
+        self._image_steps = StepTable('', (
+            (frame, data.image_name) for frame, data in zip(self._frames, self._values) if data.image_name))
+        self._pixmaps = [None] * len(self._image_steps)
 
     def paint(self, frame: float, painter: QPainter):
         if self.hidden_at(frame):
@@ -358,18 +664,65 @@ class NormalItem(ItemWithData, metaclass=ABCMeta):
             return
         painter.setOpacity(painter.opacity() * self.opacity_at(frame))
         painter.setTransform(self.transform_at(frame), True)
-        painter.drawPixmap(0, 0, img)
+        _draw(painter, img)
 
-    def image_at(self, frame: float) -> QPixmap | None:
-        frames = list(self._data.keys())
-        frames.sort()
-        frames.reverse()
-        for f in frames:
-            if f <= frame:
-                img = self._data[f].image
-                if img is not None and not img.isNull():
-                    return img
-        return None
+    def paint_evaluated(self, frame: float, painter: QPainter, state: 'TrackState', index: int) -> None:
+        if state.hidden[index]:
+            return
+        img = self.image_at(frame)
+        if img is None or img.isNull():
+            return
+        painter.setOpacity(painter.opacity() * float(state.opacity[index]))
+        painter.setTransform(state.transform(index), True)
+        _draw(painter, img)
+
+    def is_guide(self) -> bool:
+        """引导轨道只用显示与隐藏标记子动画的范围，不含图片"""
+        if self._frames is None:
+            self.build_index()
+        return not self._image_steps
+
+    def image_names(self) -> list[str]:
+        """本轨道用到的所有图片名"""
+        if self._frames is None:
+            self.build_index()
+        return list(self._image_steps.values)
+
+    def image_name_at(self, frame: float) -> str:
+        if self._frames is None:
+            self.build_index()
+        return self._image_steps.at(frame)
+
+    def image_at(self, frame: float) -> QPixmap | QImage | None:
+        if self._frames is None:
+            self.build_index()
+        i = self._image_steps.index_at(frame)
+        if i < 0:
+            return None
+        img = self._pixmaps[i]
+        if img is None:
+            img = Resources.instance().load_pixmap(self._image_steps.values[i])
+            self._pixmaps[i] = img
+        return img
+
+    def image_size_at(self, frame: float) -> QSize | None:
+        """image_at(frame) 的大小，图片尚未加载时不加载，只读取文件头"""
+        if self._frames is None:
+            self.build_index()
+        i = self._image_steps.index_at(frame)
+        if i < 0:
+            return None
+        img = self._pixmaps[i]
+        if img is not None:
+            return img.size()
+        return Resources.instance().image_size(self._image_steps.values[i])
+
+    def resolve_images(self, qimage: bool = False) -> None:
+        if self._frames is None:
+            self.build_index()
+        resources = Resources.instance()
+        load = resources.load_qimage if qimage else resources.load_pixmap
+        self._pixmaps = [load(name) for name in self._image_steps.values]
 
     def internal_to(self, start: float, end: float) -> 'Self':
         cls: type[Self] = type(self)
@@ -383,10 +736,10 @@ class NormalItem(ItemWithData, metaclass=ABCMeta):
     def bounding_rect_at(self, frame: float) -> QRectF | None:
         if self.hidden_at(frame):
             return None
-        img = self.image_at(frame)
-        if img is None or img.isNull():
+        size = self.image_size_at(frame)
+        if size is None or size.isEmpty():
             return None
-        rect = img.rect()
+        rect = QRect(QPoint(0, 0), size)
         transform = self.transform_at(frame)
         return bounding_rect([
             transform.map(QPointF(0, 0)), transform.map(rect.bottomLeft()),
@@ -404,10 +757,32 @@ class AttacherItem(ItemWithData, metaclass=ABCMeta):
         super().__init__(name)
         self.playing: Animation | None = None
         self.player: AnimationPlayer | None = None
-        # 按 time_frames 从小到大排序
-        self.anim: list[tuple[int, Animation | None, str, str]] = []  # (time_frames, animation, sub, external)
+        self._anim: list[tuple[int, Animation | None, str, str]] = []
+        self._starts: list[int] = []
+        self._players: list[AnimationPlayer | None] = []  # 每段一个播放器，首次用到时创建
+        self._frame: float | None = None  # 上一次 _recalc 的帧
         self.fps = fps
 
+    @property
+    def anim(self) -> list[tuple[int, Animation | None, str, str]]:
+        """(time_frames, animation, sub, external)，按 time_frames 从小到大排序；修改后需重新赋值"""
+        return self._anim
+
+    @anim.setter
+    def anim(self, value: list[tuple[int, Animation | None, str, str]]) -> None:
+        self._anim = value
+        self._starts = [start for start, _, _, _ in value]
+        self._players = [None] * len(value)
+        self._frame = None
+        self.playing = None
+        self.player = None
+        self._changed()
+
+    def resolve_images(self, qimage: bool = False) -> None:
+        for _, anim, _, _ in self.anim:
+            if anim is not None:
+                anim.resolve_images(qimage)
+
     def paint(self, frame: float, painter: QPainter):
         self._recalc(frame)
         if self.player is None:
@@ -419,6 +794,16 @@ class AttacherItem(ItemWithData, metaclass=ABCMeta):
         painter.setTransform(transform, True)
         self.player.paint(painter)
 
+    def paint_evaluated(self, frame: float, painter: QPainter, state: 'TrackState', index: int) -> None:
+        self._recalc(frame)
+        if self.player is None:
+            return
+        if state.hidden[index]:
+            return
+        painter.setOpacity(painter.opacity() * float(state.opacity[index]))
+        painter.setTransform(state.transform(index), True)
+        self.player.paint(painter)
+
     def internal_to(self, start: float, end: float) -> 'Self':
         res = type(self)(self.name, self.fps)
         res.playing = self.playing
@@ -450,27 +835,29 @@ class AttacherItem(ItemWithData, metaclass=ABCMeta):
             return None
         if self.hidden_at(frame):
             return None
-        return self.player.bounding_rect()
+        return self.transform_at(frame).mapRect(self.player.bounding_rect())
 
     def _recalc(self, frame: float) -> None:
-        for start, anim, sub, external in reversed(self.anim):
-            if start <= frame:
-                break
-        else:
-            # raise ValueError(f'{frame} is out of range')
+        """把 player 设为 frame 所在段的播放器并跳到对应的帧，同一帧重复调用时不做任何事"""
+        if frame == self._frame:
             return
-        if anim is None:
+        self._frame = frame
+        index = bisect_right(self._starts, frame) - 1
+        if index < 0:
             self.player = None
             self.playing = None
             return
-        elif anim is not self.playing:
-            self.player = AnimationPlayer(anim)
-            self.playing = anim
-        elif self.player is None:
+        start, anim, sub, external = self._anim[index]
+        self.playing = anim
+        if anim is None:
+            self.player = None
             return
-        if external == 'once':
-            self.player.loop_count = 1
-        self.player.goto(sub, (frame - start) / self.fps * anim.fps)
+        player = self._players[index]
+        if player is None:
+            player = self._players[index] = AnimationPlayer(anim)
+        self.player = player
+        player.loop_count = 1 if external == 'once' else -1
+        player.goto(sub, (frame - start) / self.fps * anim.fps)
 
 
 class SingleAttachItem(Item, metaclass=ABCMeta):
@@ -487,9 +874,15 @@ class SingleAttachItem(Item, metaclass=ABCMeta):
         self._ratio = self.anim.fps / self.fps
 
     def paint(self, frame: float, painter: QPainter) -> None:
-        painter.setTransform(self.transform)
+        painter.setTransform(self.transform, True)
         painter.setOpacity(painter.opacity() * self.opacity)
-        self.anim.paint(((self.start + frame) % self._max_frame) * self._ratio, painter, [])
+        self.anim.paint(self._anim_frame(frame), painter, [])
+
+    def _anim_frame(self, frame: float) -> float:
+        return ((self.start + frame) % self._max_frame) * self._ratio
+
+    def resolve_images(self, qimage: bool = False) -> None:
+        self.anim.resolve_images(qimage)
 
     def max_frame(self) -> int:
         return int(self._max_frame)
@@ -498,7 +891,7 @@ class SingleAttachItem(Item, metaclass=ABCMeta):
         return type(self)(self.name, self.anim, self.start + start, end - start, self.transform, self.fps)
 
     def bounding_rect_at(self, frame: float) -> QRectF | None:
-        return self.anim.bounding_rect_at((self.start + frame) * self._ratio, [])
+        return self.transform.mapRect(self.anim.bounding_rect_at(self._anim_frame(frame), []))
 
 
 class ReanimNormalItem(NormalItem, ReanimItemWithData):
@@ -517,6 +910,7 @@ class ReanimAttacherItem(AttacherItem, ReanimItemWithData):
         previous_playing = ''
         previous_sub = ''
         previous_external = ''
+        segments = []
         for frame, data in self._data.items():
             text = data.text
             if not text.startswith(ATTACH):
@@ -524,11 +918,11 @@ class ReanimAttacherItem(AttacherItem, ReanimItemWithData):
             playing, sub, external = _parse_attach_text(text)
             if playing != previous_playing or sub != previous_sub or external != previous_external:
                 anim = Resources.instance().load_anim_by_name(playing) if playing else None
-                self.anim.append((frame, anim, sub, external))
+                segments.append((frame, anim, sub, external))
             previous_external = external
             previous_sub = sub
             previous_playing = playing
-        self.anim.sort(key=lambda x: x[0])
+        self.anim = sorted(segments, key=lambda x: x[0])
 
 
 class ReanimSingleAttachItem(SingleAttachItem, ReanimItem):
@@ -575,7 +969,7 @@ def _parse_attach_text(s: str):
     return playing, sub, external
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ItemData:
     x: float = 0.
     y: float = 0.
@@ -584,7 +978,6 @@ class ItemData:
     scale_y: float = 1.
     x_rotate: float = 0.
     y_rotate: float = 0.
-    image: QPixmap | None = None
     hidden: bool = False
     image_name: str = ''
     text: str = ''
@@ -598,14 +991,16 @@ class ItemData:
             interpolated(self.scale_y, other.scale_y, progress),
             interpolated(self.x_rotate, other.x_rotate, progress),
             interpolated(self.y_rotate, other.y_rotate, progress),
-            # image=self.image,
             # hidden=self.hidden,
             # image_name=self.image_name,
             # text=self.text,
         )
 
     def updated(self, other: dict):
-        return ItemData(
+        """没有变化时返回自身，使连续相同的帧共用一个实例"""
+        if not other:
+            return self
+        res = ItemData(
             other.get('x', self.x),
             other.get('y', self.y),
             other.get('opacity', self.opacity),
@@ -613,11 +1008,11 @@ class ItemData:
             other.get('scale_y', self.scale_y),
             other.get('x_rotate', self.x_rotate),
             other.get('y_rotate', self.y_rotate),
-            other.get('image', self.image),
             other.get('hidden', self.hidden),
             other.get('image_name', self.image_name),
             other.get('text', self.text),
         )
+        return self if res == self else res
 
     def to_transform(self) -> QTransform:
         x_rotate = radians(self.x_rotate)
@@ -636,20 +1031,108 @@ class ItemData:
         return matrix
 
 
+TRANSITION_CACHE_SIZE: Final = 256
+
+# 所有播放器共享的过渡动画，键为 (动画, 动画的 version, 量化后的起始帧, 原子动画, 目标子动画)
+transitions: LRUCache[tuple[Animation, int, int, str, str], Animation] = LRUCache(TRANSITION_CACHE_SIZE)
+
+
+def transition(anim: Animation, frame: float, source: str, target: str) -> Animation:
+    """从子动画 source 的第 frame 帧过渡到子动画 target 的过渡动画，frame 取整到 1 / FRAME_QUANTIZATION 帧"""
+    key = round(frame * FRAME_QUANTIZATION)
+    return transitions.get_or_create(
+        (anim, anim.version, key, source, target),
+        lambda: anim.internal_to(key / FRAME_QUANTIZATION, target),
+    )
+
+
 class AnimationPlayer:
     def __init__(self, anim: Animation):
-        self.speed = 1.
-        self.loop_count = -1
+        self._batch: 'PlayerBatch | None' = None  # 加入 PlayerBatch 后 time、speed、loop_count 存放在其数组中
+        self._slot = -1
+        self._time = 0.
+        self._speed = 1.
+        self._loop_count = -1
         self.anim = anim
         self.__internal_anim: Animation | None = None
         self.__ground: NormalItem | None = cast(NormalItem | None, anim.find_item_by_name('_ground'))
         self.__previous_ground_pos: QPointF | None = None
-        self.playing = ''
-        self.hide_items: list[str] = []
+        self._playing = ''
+        self._frames = (0, anim.max_frame())  # 当前播放的子动画范围，见 playing_frames
+        self._max_frame = anim.max_frame()
+        self._frames_version = anim.version  # 计算 _frames 时 anim 的 version
+        self.hide_items: list[str] = []  # 可以直接修改，hide_mask 随之更新
+        self._mask_names: list[str] = []  # 上次计算 hide_mask 时的 hide_items
+        self._mask_version = anim.version
+        self._hide_mask = 0
         self.ground_moved: Callable[[QPointF], None] = lambda translate: None
-        self.time = 0.  # 单位：s
+        self.bake_quantization = 0  # 大于 0 时按每帧该细分数预先绘制成位图并缓存，见 anp.baked
+        self.frame_step = 0  # 大于 0 时显示的帧号向下取整到 1 / frame_step 帧，为 0 时连续插值
+
+    @property
+    def time(self) -> float:
+        """单位：s"""
+        if self._batch is None:
+            return self._time
+        return float(self._batch._time[self._slot])
+
+    @time.setter
+    def time(self, value: float) -> None:
+        if self._batch is None:
+            self._time = value
+        else:
+            self._batch._time[self._slot] = value
+
+    @property
+    def speed(self) -> float:
+        if self._batch is None:
+            return self._speed
+        return float(self._batch._speed[self._slot])
+
+    @speed.setter
+    def speed(self, value: float) -> None:
+        if self._batch is None:
+            self._speed = value
+        else:
+            self._batch._speed[self._slot] = value
+
+    @property
+    def loop_count(self) -> int:
+        if self._batch is None:
+            return self._loop_count
+        return int(self._batch._loop_count[self._slot])
+
+    @loop_count.setter
+    def loop_count(self, value: int) -> None:
+        if self._batch is None:
+            self._loop_count = value
+        else:
+            self._batch._loop_count[self._slot] = value
+
+    @property
+    def playing(self) -> str:
+        return self._playing
+
+    @playing.setter
+    def playing(self, name: str) -> None:
+        self._playing = name
+        self._resolve_frames()
+        self._sync_batch()
+
+    def _resolve_frames(self) -> None:
+        name = self._playing
+        if name:
+            start, end = self.anim.sub_anim_frame(name)
+            self._frames = (start, end)
+            self._max_frame = end - start - 1
+        else:
+            self._max_frame = self.anim.max_frame()
+            self._frames = (0, self._max_frame)
+        self._frames_version = self.anim.version
 
     def update(self, elapsed_time: float):
+        if self._batch is not None:
+            raise RuntimeError('players in a PlayerBatch are advanced by PlayerBatch.step')
         if self.loop_count == 0:
             return
         self.time += elapsed_time * self.speed
@@ -659,12 +1142,8 @@ class AnimationPlayer:
                 self.__internal_anim = None
                 self.__previous_ground_pos = None
             return
-        if not self.playing:
-            start = 0
-            max_frame = self.anim.max_frame()
-        else:
-            start, end = self.anim.sub_anim_frame(self.playing)
-            max_frame = end - start - 1
+        start = self.playing_frames()[0]
+        max_frame = self._max_frame
         if self.now_anim_frame() > max_frame:
             if self.loop_count != -1:
                 self.loop_count -= 1
@@ -688,62 +1167,96 @@ class AnimationPlayer:
     def now_anim_frame(self):
         return self.time * self.anim.fps
 
+    def display_frame(self) -> float:
+        """绘制时使用的帧号（相对子动画或过渡动画的起始帧），按 frame_step 取整"""
+        frame = self.time * self.anim.fps
+        step = self.frame_step
+        if step > 0:
+            frame = floor(frame * step) / step
+        return frame
+
     def paint(self, painter: QPainter):
         if self.loop_count == 0:
             return
-        hide_items = self.hide_items
+        hide_items = self.hide_mask
         if self.__internal_anim is not None:
-            self.__internal_anim.paint(self.now_anim_frame(), painter, hide_items)
-        elif self.playing:
-            anim = self.anim
-            start, _ = anim.sub_anim_frame(self.playing)
-            anim.paint(start + self.now_anim_frame(), painter, hide_items)
+            self.__internal_anim.paint(self.display_frame(), painter, hide_items)
+        elif self.bake_quantization > 0:
+            from .baked import bake_frame
+            quantization = self.bake_quantization
+            index = int(self.display_frame() * quantization)
+            baked = bake_frame(self.anim, self.playing, index, quantization, hide_items)
+            painter.drawPixmap(baked.offset, baked.pixmap)
         else:
-            self.anim.paint(self.now_anim_frame(), painter, hide_items)
+            self.anim.paint(self.playing_frames()[0] + self.display_frame(), painter, hide_items)
 
     def bounding_rect(self):
         if self.__internal_anim is not None:
-            return self.__internal_anim.bounding_rect_at(self.now_anim_frame(), self.hide_items)
-        if self.playing:
-            start, _ = self.anim.sub_anim_frame(self.playing)
-            return self.anim.bounding_rect_at(start + self.now_anim_frame(), self.hide_items)
-        return self.anim.bounding_rect_at(self.now_anim_frame(), self.hide_items)
+            return self.__internal_anim.bounding_rect_at(self.display_frame(), self.hide_mask)
+        return self.anim.bounding_rect_at(self.playing_frames()[0] + self.display_frame(), self.hide_mask)
+
+    def clip_bounding_rect(self) -> QRectF:
+        """当前子动画（含过渡动画）所有帧的包围盒，隐藏的轨道也计算在内"""
+        res = self.anim.clip_bounding_rect(self.playing)
+        if self.__internal_anim is not None:
+            res = res.united(self.__internal_anim.clip_bounding_rect())
+        return res
 
     def set_anim(self, name: str):
         if name == self.playing:
             return
         if self.playing:
-            self.__internal_anim = self.anim.internal_to(self.now_anim_frame(), name)
+            self.__internal_anim = transition(self.anim, self.display_frame(), self.playing, name)
         self.time = 0.
         self.loop_count = -1
         self.playing = name
 
+    @property
+    def hide_mask(self) -> int:
+        """hide_items 在 anim 中对应的轨道位掩码，过渡动画的轨道顺序与 anim 相同"""
+        if self.hide_items != self._mask_names or self._mask_version != self.anim.version:
+            self._mask_names = list(self.hide_items)
+            self._mask_version = self.anim.version
+            self._hide_mask = self.anim.hide_mask(self._mask_names)
+        return self._hide_mask
+
     def hide_item(self, name: str):
-        self.hide_items.append(name)
+        """已经隐藏时不重复添加"""
+        if name not in self.hide_items:
+            self.hide_items.append(name)
 
     def show_item(self, name: str):
-        if name in self.hide_items:
+        while name in self.hide_items:
             self.hide_items.remove(name)
 
+    def set_items_hidden(self, hidden: bool, *names: str) -> None:
+        for name in names:
+            if hidden:
+                self.hide_item(name)
+            else:
+                self.show_item(name)
+
     def playing_frames(self) -> tuple[int, int]:
-        if not self.playing:
-            return 0, self.anim.max_frame()
-        return self.anim.sub_anim_frame(self.playing)
+        """anim 修改后（version 改变）按 playing 重新计算"""
+        if self._frames_version != self.anim.version:
+            self._resolve_frames()
+        return self._frames
 
     def set_anim_frame(self, frame: float) -> None:
         if self.loop_count == 0:
             return
         self.time = frame / self.anim.fps
         self.__internal_anim = None
+        self._sync_batch()
 
     def max_frame(self) -> int:
-        if self.playing:
-            start, end = self.anim.sub_anim_frame(self.playing)
-            return end - start - 1
-        return self.anim.max_frame()
+        if self._frames_version != self.anim.version:
+            self._resolve_frames()
+        return self._max_frame
 
     def goto(self, anim: str, frame: float) -> None:
-        self.playing = anim
+        if anim != self._playing:
+            self.playing = anim
         elapsed_loop, frame = divmod(frame, self.max_frame())
         self.time = frame / self.anim.fps
         if self.loop_count != -1:
@@ -751,15 +1264,92 @@ class AnimationPlayer:
             if self.loop_count < 0:
                 self.loop_count = 0
 
+    def visible_state(self) -> tuple:
+        """决定 paint 结果的状态，两次调用结果相等时绘制的内容相同"""
+        if self.loop_count == 0:
+            return ()
+        return self.__internal_anim, self._playing, self.display_frame(), self.hide_mask, \
+            self.bake_quantization
+
+    def transition_max_frame(self) -> int:
+        """正在播放的过渡动画的最后一帧，没有过渡动画时为 -1"""
+        if self.__internal_anim is None:
+            return -1
+        return self.__internal_anim.max_frame()
+
+    @property
+    def batch(self) -> 'PlayerBatch | None':
+        """所属的 PlayerBatch，加入后由 PlayerBatch.step 推进，不能调用 update"""
+        return self._batch
+
+    def ground_track(self) -> 'NormalItem | None':
+        return self.__ground
+
+    def _sync_batch(self) -> None:
+        if self._batch is not None:
+            self._batch.sync(self)
+
+    def _attach(self, batch: 'PlayerBatch', slot: int) -> None:
+        self._batch = batch
+        self._slot = slot
+        self.__previous_ground_pos = None
+
+    def _detach(self) -> None:
+        """离开 PlayerBatch，把数组中的状态取回到自身"""
+        time, speed, loop_count = self.time, self.speed, self.loop_count
+        self._batch = None
+        self._slot = -1
+        self._time, self._speed, self._loop_count = time, speed, loop_count
+
+    def _end_transition(self) -> None:
+        self.__internal_anim = None
+
+
+class StepTable(Generic[T]):
+    """阶梯函数：记录每段取值的起始帧，按帧二分查找当前取值"""
+
+    def __init__(self, default: T, steps: Iterable[tuple[int, T]] = ()):
+        self.default = default
+        self.starts: list[int] = []
+        self.values: list[T] = []
+        for start, value in steps:
+            if self.values and self.values[-1] == value:
+                continue
+            self.starts.append(start)
+            self.values.append(value)
+
+    def index_at(self, frame: float) -> int:
+        """frame 所在段的下标，早于第一段时为 -1"""
+        return bisect_right(self.starts, frame) - 1
+
+    def at(self, frame: float) -> T:
+        i = bisect_right(self.starts, frame) - 1
+        if i < 0:
+            return self.default
+        return self.values[i]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
 
 def interpolated(a: float, b: float, progress: float) -> float:
     return a + (b - a) * progress
 
 
-def find_range(choices: list[real], base: float) -> tuple[real, real]:
-    a = max(i for i in choices if i <= base)
-    b = min(i for i in choices if i >= base)
-    return a, b
+def _draw(painter: QPainter, img: QPixmap | QImage) -> None:
+    if isinstance(img, QImage):
+        painter.drawImage(0, 0, img)
+    else:
+        painter.drawPixmap(0, 0, img)
+
+
+def _state_size(state: 'TrackState') -> int:
+    return state.values.nbytes + state.matrices.nbytes + state.hidden.nbytes
+
+
+def _round(values: np.ndarray) -> np.ndarray:
+    """按 qRound 的规则（四舍五入，远离零）取整"""
+    return np.where(values >= 0, np.floor(values + 0.5), np.ceil(values - 0.5))
 
 
 def bounding_rect(points: list[QPointF | QRectF | QPoint | QRect]) -> QRectF:
@@ -0,0 +1,299 @@
+"""
+.reanimc：Reanim 的二进制缓存格式，全部为小端序
+
+- 文件头 HEADER
+- 轨道表：每条轨道一个 TRACK（名称在字符串表中的下标、类型、帧数）
+- 字段数组：float64，形状为 (len(FIELDS), 轨道数, 帧数)，不足帧数的轨道用最后一帧补齐
+- 隐藏标记：uint8，形状为 (轨道数, 帧数)
+- 图片名与文本：int32，形状为 (轨道数, 帧数)，值为字符串表中的下标
+- TrackTable：float32 的字段数组与 bool 的隐藏标记，与 Animation.tracks() 相同，加载后直接作为它的视图
+- 字符串表：字符串个数，之后每个字符串为 (字节长度, UTF-8 字节)
+
+各段均按 8 字节对齐。加载后文件保持映射，直到 TrackTable 被释放。
+
+python -m anp.reanimc <.reanim 文件>... 比较解析 XML 与读取缓存的耗时。
+"""
+import argparse
+import dataclasses
+import os
+import struct
+import tempfile
+from hashlib import sha1
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from time import perf_counter
+from typing import Final, NamedTuple
+
+import numpy as np
+
+from .player import Reanim, ReanimItem, ReanimNormalItem, ReanimAttacherItem, ReanimSingleAttachItem, ItemData, \
+    ItemWithData
+from .tracks import FIELDS, TrackTable
+
+__all__ = (
+    'SUFFIX',
+    'load_reanim',
+    'save_compiled',
+    'load_compiled',
+    'cache_path_for',
+)
+
+SUFFIX: Final = '.reanimc'
+MAGIC: Final = b'RANC'
+VERSION: Final = 2
+HEADER: Final = struct.Struct('<4sHHdqq20sII')  # magic, version, 保留, fps, mtime_ns, size, sha1, 轨道数, 帧数
+TRACK: Final = struct.Struct('<III')  # 名称, 类型, 帧数
+LENGTH: Final = struct.Struct('<I')
+KIND_NORMAL: Final = 0
+KIND_ATTACHER: Final = 1
+KIND_SINGLE_ATTACH: Final = 2
+# FIELDS 在 ItemData 构造参数中的顺序
+DATA_FIELDS: Final = [FIELDS.index(field.name) for field in dataclasses.fields(ItemData) if field.name in FIELDS]
+
+
+class SourceKey(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: bytes
+
+
+def source_key(path: Path) -> SourceKey:
+    stat = path.stat()
+    return SourceKey(stat.st_mtime_ns, stat.st_size, sha1(path.read_bytes()).digest())
+
+
+def cache_path_for(path: Path, cache_dir: Path) -> Path:
+    return cache_dir / f'{sha1(str(path.resolve()).encode()).hexdigest()}{SUFFIX}'
+
+
+def load_reanim(path: Path, cache_dir: Path) -> Reanim:
+    """优先从 cache_dir 中的缓存加载，缓存缺失或过期时解析 XML 并重新生成缓存"""
+    cache_path = cache_path_for(path, cache_dir)
+    res = load_compiled(cache_path, path)
+    if res is not None:
+        return res
+    key = source_key(path)
+    res = Reanim.load(path)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        save_compiled(res, cache_path, key)
+    except OSError as e:
+        print(f'cannot write {cache_path}: {e}')
+    return res
+
+
+def load_compiled(cache_path: Path, source: Path | None = None) -> Reanim | None:
+    """读取缓存，缓存无效或与 source 不一致时返回 None"""
+    try:
+        with cache_path.open('rb') as f:
+            mm = mmap(f.fileno(), 0, access=ACCESS_READ)
+        header = _read_header(mm)
+        if header is None or source is not None and not _is_fresh(header, source, cache_path):
+            mm.close()
+            return None
+        # 不关闭 mm：返回的 TrackTable 是它的视图，释放时自动解除映射
+        return _load(mm, header)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def save_compiled(anim: Reanim, cache_path: Path, key: SourceKey) -> None:
+    strings: dict[str, int] = {'': 0}
+
+    def string_index(s: str) -> int:
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    items: list[ReanimItem] = anim._items  # type: ignore[assignment]
+    frame_count = max(anim.max_frame() + 1, 1)
+    values = np.zeros((len(FIELDS), len(items), frame_count), np.float64)
+    hidden = np.zeros((len(items), frame_count), np.uint8)
+    images = np.zeros((len(items), frame_count), np.int32)
+    texts = np.zeros((len(items), frame_count), np.int32)
+    tracks = []
+    for index, item in enumerate(items):
+        if isinstance(item, ReanimSingleAttachItem):
+            kind = KIND_SINGLE_ATTACH
+            frames = [item.data]
+        else:
+            assert isinstance(item, ItemWithData)
+            kind = KIND_ATTACHER if isinstance(item, ReanimAttacherItem) else KIND_NORMAL
+            frames = [data for _, data in item.keyframes()]
+        tracks.append((string_index(item.name), kind, len(frames)))
+        for frame in range(frame_count):
+            data = frames[min(frame, len(frames) - 1)]
+            values[:, index, frame] = [getattr(data, name) for name in FIELDS]
+            hidden[index, frame] = data.hidden
+            images[index, frame] = string_index(data.image_name)
+            texts[index, frame] = string_index(data.text)
+
+    table = anim.tracks()
+    assert table.frame_count == frame_count
+    header = HEADER.pack(MAGIC, VERSION, 0, anim.fps, key.mtime_ns, key.size, key.digest, len(items), frame_count)
+    chunks = [header]
+    chunks.extend(TRACK.pack(*track) for track in tracks)
+    for array in (values, hidden, images, texts, table.values.astype(np.float32), table.hidden.astype(np.bool_)):
+        chunks.append(_padding(sum(map(len, chunks))))
+        chunks.append(array.tobytes())
+    chunks.append(_padding(sum(map(len, chunks))))
+    chunks.append(LENGTH.pack(len(strings)))
+    for s in strings:
+        encoded = s.encode('utf-8')
+        chunks.append(LENGTH.pack(len(encoded)))
+        chunks.append(encoded)
+
+    temp = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    try:
+        temp.write_bytes(b''.join(chunks))
+        os.replace(temp, cache_path)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+class _Header(NamedTuple):
+    fps: float
+    key: SourceKey
+    track_count: int
+    frame_count: int
+
+
+def _read_header(mm: mmap) -> _Header | None:
+    magic, version, _, fps, mtime_ns, size, digest, track_count, frame_count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return _Header(fps, SourceKey(mtime_ns, size, digest), track_count, frame_count)
+
+
+def _is_fresh(header: _Header, source: Path, cache_path: Path) -> bool:
+    stat = source.stat()
+    key = header.key
+    if key.mtime_ns == stat.st_mtime_ns and key.size == stat.st_size:
+        return True
+    # 只有修改时间变化时比较内容，内容相同则更新缓存中的修改时间，之后不再重复计算哈希
+    if key.size != stat.st_size or key.digest != sha1(source.read_bytes()).digest():
+        return False
+    try:
+        with cache_path.open('r+b') as f:
+            f.write(HEADER.pack(
+                MAGIC, VERSION, 0, header.fps, stat.st_mtime_ns, key.size, key.digest,
+                header.track_count, header.frame_count,
+            ))
+    except OSError:
+        pass
+    return True
+
+
+def _load(mm: mmap, header: _Header) -> Reanim:
+    track_count = header.track_count
+    frame_count = header.frame_count
+    offset = HEADER.size
+    tracks = [TRACK.unpack_from(mm, offset + i * TRACK.size) for i in range(track_count)]
+    offset += TRACK.size * track_count
+
+    def view(dtype: type, shape: tuple[int, ...]) -> np.ndarray:
+        nonlocal offset
+        offset = _align(offset)
+        res = np.frombuffer(mm, dtype, int(np.prod(shape)), offset).reshape(shape)
+        offset += res.nbytes
+        return res
+
+    shape = (track_count, frame_count)
+    values = view(np.float64, (len(FIELDS), *shape))
+    hidden = view(np.bool_, shape)
+    images = view(np.int32, shape)
+    texts = view(np.int32, shape)
+    table = TrackTable(view(np.float32, (len(FIELDS), *shape)), view(np.bool_, shape))
+
+    offset = _align(offset)
+    (string_count,) = LENGTH.unpack_from(mm, offset)
+    offset += LENGTH.size
+    strings = []
+    for _ in range(string_count):
+        (length,) = LENGTH.unpack_from(mm, offset)
+        offset += LENGTH.size
+        strings.append(bytes(mm[offset: offset + length]).decode('utf-8'))
+        offset += length
+
+    # 只在与前一帧不同的帧上创建 ItemData，连续相同的帧共用一个实例
+    changed = np.ones(shape, np.bool_)
+    np.any(values[:, :, 1:] != values[:, :, :-1], axis=0, out=changed[:, 1:])
+    changed[:, 1:] |= hidden[:, 1:] != hidden[:, :-1]
+    changed[:, 1:] |= images[:, 1:] != images[:, :-1]
+    changed[:, 1:] |= texts[:, 1:] != texts[:, :-1]
+    fps = header.fps
+    items: list[ReanimItem] = []
+    for index, (name_index, kind, length) in enumerate(tracks):
+        starts = np.flatnonzero(changed[index, :length])
+        keys = [
+            ItemData(*fields, is_hidden, strings[image], strings[text])
+            for fields, is_hidden, image, text in zip(
+                values[DATA_FIELDS, index][:, starts].T.tolist(),
+                hidden[index, starts].tolist(),
+                images[index, starts].tolist(),
+                texts[index, starts].tolist(),
+            )
+        ]
+        runs = np.diff(starts, append=length)
+        frames = np.repeat(np.array(keys, object), runs).tolist()
+        items.append(_make_item(strings[name_index], kind, frames, fps))
+
+    res = Reanim(fps, items)
+    res.sub_anim_index()
+    res._tracks = table
+    return res
+
+
+def _make_item(name: str, kind: int, frames: list[ItemData], fps: float) -> ReanimItem:
+    if kind == KIND_SINGLE_ATTACH:
+        return ReanimSingleAttachItem(name, frames[0], fps)
+    res: ReanimNormalItem | ReanimAttacherItem
+    if kind == KIND_ATTACHER:
+        res = ReanimAttacherItem(name, fps)
+    else:
+        res = ReanimNormalItem(name)
+    res.set_frames(frames)
+    res.build_index()
+    res.read_complete_recall()
+    return res
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _padding(offset: int) -> bytes:
+    return bytes(_align(offset) - offset)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m anp.reanimc', description='比较解析 XML 与读取缓存的耗时')
+    parser.add_argument('inputs', nargs='+', type=Path, help='.reanim 文件')
+    parser.add_argument('--root', type=Path, help='PvZ 资源根目录，用于加载附件动画')
+    parser.add_argument('--repeat', type=int, default=10, help='取多次加载中最快的一次')
+    args = parser.parse_args(argv)
+    if args.root is not None:
+        import Resources
+        Resources.resources_root = args.root.resolve()
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as cache_dir:
+        for path in args.inputs:
+            cache_path = cache_path_for(path, Path(cache_dir))
+            save_compiled(Reanim.load(path), cache_path, source_key(path))
+            xml = _best_time(lambda: Reanim.load(path), args.repeat)
+            compiled = _best_time(lambda: load_compiled(cache_path, path), args.repeat)
+            print(f'{path.name}: xml {xml * 1000:.1f} ms, reanimc {compiled * 1000:.1f} ms, {xml / compiled:.1f}x')
+    return 0
+
+
+def _best_time(load, repeat: int) -> float:
+    res = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        load()
+        res = min(res, perf_counter() - start)
+    return res
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
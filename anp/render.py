@@ -0,0 +1,169 @@
+"""
+python -m anp render：不显示窗口，批量把 .reanim 的每个子动画导出为 PNG 序列、视频、精灵图或去重打包的精灵图
+
+例：python -m anp render "reanim/*.reanim" --root PvZ --format mp4 --out previews
+"""
+import argparse
+import glob
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+from time import perf_counter
+from typing import Final, Iterable, NamedTuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .player import Animation
+
+__all__ = (
+    'FORMATS',
+    'main',
+    'find_reanims',
+    'output_dirs',
+    'render_file',
+)
+
+FORMATS: Final = ('png', 'mp4', 'avi', 'sheet', 'atlas')  # sheet 为等大的格子，atlas 裁剪、去重后打包
+
+
+class RenderOptions(NamedTuple):
+    out: Path
+    format: str
+    fps: float
+    clips: tuple[str, ...]  # 为空时导出所有子动画
+
+
+class RenderResult(NamedTuple):
+    source: Path
+    outputs: int  # 导出的子动画个数
+    frames: int
+    seconds: float
+
+
+def find_reanims(inputs: list[str]) -> list[Path]:
+    """inputs 中的每一项可以是 .reanim 文件、文件夹（包括子文件夹中的所有 .reanim）或 glob"""
+    res: list[Path] = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            res.extend(sorted(path.rglob('*.reanim')))
+        elif path.is_file():
+            res.append(path)
+        else:
+            res.extend(Path(name) for name in sorted(glob.glob(item, recursive=True)))
+    return list(dict.fromkeys(path.resolve() for path in res))
+
+
+def output_dirs(sources: list[Path]) -> list[Path]:
+    """各文件在输出文件夹中的子文件夹：一般为文件名（不含扩展名），
+    文件名相同（不区分大小写）的文件改用相对于它们共同上级文件夹的路径，避免互相覆盖"""
+    counts = Counter(source.stem.lower() for source in sources)
+    duplicated = [source for source in sources if counts[source.stem.lower()] > 1]
+    if not duplicated:
+        return [Path(source.stem) for source in sources]
+    common = Path(os.path.commonpath([source.parent for source in duplicated]))
+    return [
+        source.relative_to(common).with_suffix('') if counts[source.stem.lower()] > 1 else Path(source.stem)
+        for source in sources
+    ]
+
+
+def render_file(source: Path, options: RenderOptions, directory: Path | None = None) -> RenderResult:
+    """输出到 options.out 中的 directory 子文件夹，默认为文件名；
+    需要先创建 QGuiApplication 并设置 Resources，见 parallel.init_offscreen"""
+    from Resources import Resources
+    from .export import write_video, write_png_sequence, write_grid_sheet
+    from .spritesheet import write_sprite_sheet
+    start = perf_counter()
+    anim = Resources.instance().load_reanim(source)
+    anim.resolve_images()
+    clips = _clips(anim, options.clips)
+    directory = options.out / (source.stem if directory is None else directory)
+    if clips:
+        directory.mkdir(parents=True, exist_ok=True)
+    frames = 0
+    for clip in clips:
+        name = clip or source.stem
+        if options.format == 'png':
+            frames += write_png_sequence(anim, directory / name, options.fps, clip)
+        elif options.format == 'sheet':
+            frames += write_grid_sheet(anim, directory / f'{name}.png', options.fps, clip)
+        elif options.format == 'atlas':
+            frames += write_sprite_sheet(anim, directory / f'{name}.png', options.fps, clip)
+        else:
+            frames += write_video(anim, directory / f'{name}.{options.format}', options.fps, clip)
+    return RenderResult(source, len(clips), frames, perf_counter() - start)
+
+
+def _clips(anim: 'Animation', wanted: tuple[str, ...]) -> list[str]:
+    """要导出的子动画，动画中没有的跳过；没有子动画时导出整个动画"""
+    clips = anim.clip_names()
+    if wanted:
+        return [name for name in wanted if name in clips]
+    return clips or ['']
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m anp render', description='批量导出 .reanim 的子动画')
+    parser.add_argument('inputs', nargs='+', help='.reanim 文件、文件夹或 glob')
+    parser.add_argument('--root', type=Path, help='PvZ 资源根目录，默认为第一个文件所在文件夹的上一级')
+    parser.add_argument('--properties', type=Path, help='resources.xml，用于查找图片和附件动画')
+    parser.add_argument('--out', type=Path, default=Path('render'), help='输出文件夹')
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--fps', type=float, default=60.)
+    parser.add_argument('--clip', action='append', default=[], help='只导出这些子动画，可以重复指定')
+    parser.add_argument('--jobs', type=int, default=0, help='进程数，默认为 CPU 核数，为 1 时在当前进程中导出')
+    parser.add_argument('--no-cache', action='store_true', help='不读写 .reanimc 缓存')
+    args = parser.parse_args(argv)
+
+    sources = find_reanims(args.inputs)
+    if not sources:
+        parser.error('no .reanim file found')
+    import Resources
+    root = (args.root or sources[0].parent.parent).resolve()
+    Resources.resources_root = root
+    resources = Resources.Resources.instance()
+    if args.properties is not None:
+        resources.load_properties(args.properties, strict=False)
+    cache_dir = None if args.no_cache else resources.reanim_cache_dir
+    options = RenderOptions(args.out.resolve(), args.format, args.fps, tuple(args.clip))
+
+    directories = output_dirs(sources)
+    from .parallel import init_offscreen
+    init_args = (root, resources.prop_all, cache_dir)
+    start = perf_counter()
+    failed = 0
+    if args.jobs == 1:
+        init_offscreen(*init_args)
+        results = (_try_render(source, options, directory) for source, directory in zip(sources, directories))
+        failed = _report(results)
+    else:
+        with ProcessPoolExecutor(args.jobs or None, get_context('spawn'), init_offscreen, init_args) as pool:
+            futures = [
+                pool.submit(_try_render, source, options, directory)
+                for source, directory in zip(sources, directories)
+            ]
+            failed = _report(future.result() for future in as_completed(futures))
+    print(f'{len(sources) - failed}/{len(sources)} files in {perf_counter() - start:.2f}s')
+    return 1 if failed else 0
+
+
+def _try_render(source: Path, options: RenderOptions, directory: Path) -> RenderResult | tuple[Path, str]:
+    try:
+        return render_file(source, options, directory)
+    except Exception as e:
+        return source, f'{type(e).__name__}: {e}'
+
+
+def _report(results: Iterable[RenderResult | tuple[Path, str]]) -> int:
+    failed = 0
+    for result in results:
+        if isinstance(result, RenderResult):
+            print(f'{result.source.name}: {result.outputs} clips, {result.frames} frames, {result.seconds:.2f}s',
+                  flush=True)
+        else:
+            source, message = result
+            print(f'{source.name}: failed: {message}', flush=True)
+            failed += 1
+    return failed
@@ -0,0 +1,97 @@
+import json
+from hashlib import blake2b
+from math import ceil
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from PySide6.QtGui import QImage, Qt
+
+from .atlas import ShelfPacker
+from .export import export_frames, qimage_array, render_frames
+from .player import Animation
+
+__all__ = (
+    'SpriteSheet',
+    'SheetFrame',
+    'build_sprite_sheet',
+    'write_sprite_sheet',
+)
+
+
+class SheetFrame(NamedTuple):
+    sprite: int  # 在 SpriteSheet.sprites 中的下标，完全透明的帧为 -1
+    x: int  # 裁剪后的图片在未裁剪的帧中的位置
+    y: int
+
+
+class SpriteSheet(NamedTuple):
+    image: QImage
+    sprites: list[tuple[int, int, int, int]]  # 每张不同的图片在 image 中的 (x, y, 宽, 高)
+    frames: list[SheetFrame]
+    frame_size: tuple[int, int]  # 未裁剪的帧的大小
+    origin: tuple[float, float]  # 动画坐标原点在未裁剪的帧中的位置
+    fps: float
+
+    def table(self, image_name: str) -> dict:
+        """可以写成 JSON 的帧表"""
+        return {
+            'image': image_name,
+            'size': [self.image.width(), self.image.height()],
+            'fps': self.fps,
+            'frame_size': list(self.frame_size),
+            'origin': list(self.origin),
+            'sprites': [list(sprite) for sprite in self.sprites],
+            'frames': [list(frame) for frame in self.frames],
+        }
+
+
+def build_sprite_sheet(anim: Animation, fps: float = 60., clip: str = '', padding: int = 1) -> SpriteSheet:
+    """把子动画 clip 的每一帧裁掉透明的边缘，像素完全相同的帧只保存一次，再逐行打包到一张图片中"""
+    bounding = anim.clip_bounding_rect(clip)
+    digests: dict[bytes, int] = {}
+    pixels: list[np.ndarray] = []
+    frames: list[SheetFrame] = []
+    for img in render_frames(anim, export_frames(anim, fps, clip), bounding):
+        bgra = qimage_array(img)
+        rows = np.flatnonzero(bgra[:, :, 3].any(axis=1))
+        if not rows.size:
+            frames.append(SheetFrame(-1, 0, 0))
+            continue
+        columns = np.flatnonzero(bgra[:, :, 3].any(axis=0))
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        left, right = int(columns[0]), int(columns[-1]) + 1
+        trimmed = bgra[top:bottom, left:right]
+        digest = blake2b(trimmed.tobytes(), digest_size=16, person=np.int32(trimmed.shape[:2]).tobytes()).digest()
+        sprite = digests.get(digest)
+        if sprite is None:
+            sprite = digests[digest] = len(pixels)
+            pixels.append(trimmed.copy())
+        frames.append(SheetFrame(sprite, left, top))
+
+    sizes = [(sprite.shape[1], sprite.shape[0]) for sprite in pixels]
+    area = sum((width + padding) * (height + padding) for width, height in sizes)
+    page_width = max([ceil(area ** .5), *(width for width, _ in sizes), 1])
+    placements, pages = ShelfPacker(page_width, None, padding).pack(sizes)
+    width, height = pages[0] if pages else (0, 0)
+    image = QImage(max(width, 1), max(height, 1), QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+    sheet = qimage_array(image, True)
+    sprites = []
+    for sprite, (_, x, y) in zip(pixels, placements):
+        sprite_height, sprite_width = sprite.shape[:2]
+        sheet[y: y + sprite_height, x: x + sprite_width] = sprite
+        sprites.append((x, y, sprite_width, sprite_height))
+    del sheet
+    size = bounding.size().toSize()
+    return SpriteSheet(image, sprites, frames, (size.width(), size.height()), (-bounding.x(), -bounding.y()), fps)
+
+
+def write_sprite_sheet(anim: Animation, path: str | Path, fps: float = 60., clip: str = '', padding: int = 1) -> int:
+    """把精灵图存为 path，帧表存为同名的 .json，返回帧数"""
+    path = Path(path)
+    sheet = build_sprite_sheet(anim, fps, clip, padding)
+    if not sheet.image.save(str(path)):
+        raise OSError(f'cannot write {path}')
+    path.with_suffix('.json').write_text(json.dumps(sheet.table(path.name)), 'utf-8')
+    return len(sheet.frames)
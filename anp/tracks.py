@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+from typing import Final, Iterable
+
+import numpy as np
+from PySide6.QtGui import QTransform
+
+from .player import Item, ItemWithData, SingleAttachItem, ItemData
+
+__all__ = (
+    'FIELDS',
+    'TrackTable',
+    'TrackState',
+)
+
+FIELDS: Final = ('x', 'y', 'scale_x', 'scale_y', 'x_rotate', 'y_rotate', 'opacity')
+
+
+@dataclass
+class TrackState:
+    """某一帧所有轨道的插值结果，数组的第一维是轨道下标"""
+    values: np.ndarray  # (len(FIELDS), 轨道数)
+    matrices: np.ndarray  # (轨道数, 2, 3)，即 [[a, c, tx], [b, d, ty]]
+    hidden: np.ndarray  # (轨道数,)
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.values[0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.values[1]
+
+    @property
+    def scale_x(self) -> np.ndarray:
+        return self.values[2]
+
+    @property
+    def scale_y(self) -> np.ndarray:
+        return self.values[3]
+
+    @property
+    def x_rotate(self) -> np.ndarray:
+        return self.values[4]
+
+    @property
+    def y_rotate(self) -> np.ndarray:
+        return self.values[5]
+
+    @property
+    def opacity(self) -> np.ndarray:
+        return self.values[6]
+
+    def transform(self, index: int) -> QTransform:
+        """与 ItemData.to_transform 相同的变换"""
+        (a, c, tx), (b, d, ty) = self.matrices[index].tolist()
+        return QTransform(
+            a, b, 0,
+            c, d, 0,
+            tx, ty, 1,
+        )
+
+
+class TrackTable:
+    """Animation 的列式表示：每个字段是一个 (轨道数, 帧数) 的 float32 数组"""
+
+    def __init__(self, values: np.ndarray, hidden: np.ndarray):
+        assert values.shape[0] == len(FIELDS) and values.shape[1:] == hidden.shape
+        self.values = values  # (len(FIELDS), 轨道数, 帧数)
+        self.hidden = hidden  # (轨道数, 帧数)
+
+    @property
+    def track_count(self) -> int:
+        return self.hidden.shape[0]
+
+    @property
+    def frame_count(self) -> int:
+        return self.hidden.shape[1]
+
+    def field(self, name: str) -> np.ndarray:
+        return self.values[FIELDS.index(name)]
+
+    @staticmethod
+    def from_items(items: Iterable[Item], frame_count: int) -> 'TrackTable':
+        items = list(items)
+        frame_count = max(frame_count, 1)
+        values = np.empty((len(FIELDS), len(items), frame_count), np.float32)
+        hidden = np.zeros((len(items), frame_count), np.bool_)
+        for index, item in enumerate(items):
+            if isinstance(item, ItemWithData):
+                for frame in range(frame_count):
+                    values[:, index, frame] = _field_values(item.data_at(frame))
+                    hidden[index, frame] = item.hidden_at(frame)
+            elif isinstance(item, SingleAttachItem):
+                values[:, index, :] = np.array(_field_values(item.data), np.float32)[:, None]
+            else:
+                values[:, index, :] = np.array(_field_values(ItemData()), np.float32)[:, None]
+        return TrackTable(values, hidden)
+
+    def evaluate(self, frame: float) -> TrackState:
+        last = self.frame_count - 1
+        frame = min(max(frame, 0.), float(last))
+        f0 = int(frame)
+        progress = frame - f0
+        if progress:
+            v0 = self.values[:, :, f0]
+            values = v0 + (self.values[:, :, f0 + 1] - v0) * np.float32(progress)
+        else:
+            values = self.values[:, :, f0]
+        return TrackState(values, affine_matrices(values), self.hidden[:, f0])
+
+
+def affine_matrices(values: np.ndarray) -> np.ndarray:
+    """由 (len(FIELDS), n) 的字段数组批量计算 ItemData.to_transform 对应的 2x3 矩阵"""
+    x, y, scale_x, scale_y, x_rotate, y_rotate, _ = values.astype(np.float32)
+    x_rotate = np.radians(x_rotate)
+    y_rotate = np.radians(y_rotate)
+    res = np.empty((values.shape[1], 2, 3))
+    res[:, 0, 0] = scale_x * np.cos(x_rotate)
+    res[:, 1, 0] = scale_x * np.sin(x_rotate)
+    res[:, 0, 1] = -scale_y * np.sin(y_rotate)
+    res[:, 1, 1] = scale_y * np.cos(y_rotate)
+    res[:, 0, 2] = x
+    res[:, 1, 2] = y
+    return res
+
+
+def _field_values(data: ItemData) -> tuple[float, ...]:
+    return tuple(getattr(data, name) for name in FIELDS)